@@ -7,9 +7,12 @@ export interface Model {
 
 export interface User extends Model {}
 
+export type Outcome = "yes" | "no";
+
 export interface Market extends Model {
   name: string;
   description: string;
+  outcome: Outcome | null; // set once resolved, no more orders are taken
 }
 
 export interface MarketCreateInfo {
@@ -38,15 +41,77 @@ export interface MarketTrade {
   quantity: number;
 }
 
+// pass `after` to page forward to newer trades, `before` to page back
 export interface MarketTrades {
   market_id: Uuid;
   midpoint: number | null;
   trades: MarketTrade[];
+  after: number;
+  before: number;
+}
+
+export type CandleResolution = "1m" | "1h" | "1d";
+
+export interface MarketCandle {
+  time: string; // ISO date string, bucket start
+  open: number;
+  high: number;
+  low: number;
+  close: number;
+  volume: number;
+  vwap: number;
+}
+
+export interface MarketCandles {
+  market_id: Uuid;
+  resolution: CandleResolution;
+  candles: MarketCandle[];
 }
 
 export interface UserTrades {
   user_id: Uuid;
   trades: MarketTrade[];
+  after: string;
+  before: string;
+}
+
+export interface UserPosition {
+  market_id: Uuid;
+  quantity: number; // negative when short
+  entry_price: number | null; // null while flat
+  realized_pnl: number;
+}
+
+export interface UserPortfolio {
+  user_id: Uuid;
+  cash: number;
+  realized_pnl: number;
+  positions: UserPosition[];
+}
+
+export interface LeaderboardEntry {
+  rank: number;
+  user_id: Uuid;
+  pnl: number;
+  realized_pnl: number;
+  unrealized_pnl: number; // open positions at each market's midpoint
+}
+
+export interface Leaderboard {
+  entries: LeaderboardEntry[];
+}
+
+export interface MarketResolution {
+  market_id: Uuid;
+  outcome: Outcome;
+  cancelled: number; // resting orders dropped
+  positions: number; // open positions paid out
+}
+
+export interface TradePage<C> {
+  limit?: number;
+  after?: C;
+  before?: C;
 }
 
 export interface MarketClobOrder {
@@ -60,6 +125,29 @@ export interface MarketClob {
   asks: MarketClobOrder[];
 }
 
+export interface MarketTop {
+  midpoint: number | null;
+  bid: MarketClobOrder | null;
+  ask: MarketClobOrder | null;
+}
+
+export interface MarketStreamSnapshot extends MarketClob {
+  type: "snapshot";
+  seq: number;
+}
+
+// changed levels only, quantity 0 once a level empties
+export interface MarketStreamDelta {
+  type: "delta";
+  seq: number;
+  midpoint: number | null;
+  bids: MarketClobOrder[];
+  asks: MarketClobOrder[];
+  trades: MarketTrade[];
+}
+
+export type MarketStreamEvent = MarketStreamSnapshot | MarketStreamDelta;
+
 export interface Order extends Model {
   user_id: Uuid;
   side: OrderSide;
@@ -67,6 +155,18 @@ export interface Order extends Model {
   quantity: number;
 }
 
+function pageQuery<C>(page: TradePage<C>): string {
+  const params = new URLSearchParams();
+  for (const [key, value] of Object.entries(page)) {
+    if (value != null) {
+      params.set(key, String(value));
+    }
+  }
+
+  const query = params.toString();
+  return query ? `?${query}` : "";
+}
+
 export class MarketsClient {
   private readonly baseURL: string;
 
@@ -123,18 +223,82 @@ export class MarketsClient {
     }
   }
 
-  async getTrades(marketId: Uuid): Promise<MarketTrades> {
-    return this.request<MarketTrades>(`/markets/${marketId}/trades`, "GET");
+  // without `after`, a limited page holds the newest trades
+  async getTrades(
+    marketId: Uuid,
+    page: TradePage<number> = {}
+  ): Promise<MarketTrades> {
+    return this.request<MarketTrades>(
+      `/markets/${marketId}/trades${pageQuery(page)}`,
+      "GET"
+    );
+  }
+
+  async getCandles(
+    marketId: Uuid,
+    resolution: CandleResolution = "1m",
+    from: string | null = null,
+    to: string | null = null
+  ): Promise<MarketCandles> {
+    const params = new URLSearchParams({ resolution });
+    if (from != null) {
+      params.set("from", from);
+    }
+    if (to != null) {
+      params.set("to", to);
+    }
+
+    return this.request<MarketCandles>(
+      `/markets/${marketId}/candles?${params}`,
+      "GET"
+    );
+  }
+
+  async getUserTrades(
+    userId: Uuid,
+    page: TradePage<string> = {}
+  ): Promise<UserTrades> {
+    return this.request<UserTrades>(
+      `/users/${userId}/trades${pageQuery(page)}`,
+      "GET"
+    );
   }
 
-  async getUserTrades(userId: Uuid): Promise<UserTrades> {
-    return this.request<UserTrades>(`/users/${userId}/trades`, "GET");
+  async getUserPortfolio(userId: Uuid): Promise<UserPortfolio> {
+    return this.request<UserPortfolio>(`/users/${userId}/portfolio`, "GET");
+  }
+
+  async getLeaderboard(limit: number | null = null): Promise<Leaderboard> {
+    const query = limit != null ? `?limit=${limit}` : "";
+    return this.request<Leaderboard>(`/leaderboard${query}`, "GET");
   }
 
   async getMarket(marketId: Uuid): Promise<Market> {
     return this.request<Market>(`/markets/${marketId}`, "GET");
   }
 
+  async resolveMarket(
+    marketId: Uuid,
+    outcome: Outcome
+  ): Promise<MarketResolution> {
+    return this.request<MarketResolution>(
+      `/markets/${marketId}/resolve`,
+      "POST",
+      { outcome }
+    );
+  }
+
+  // settled together, each market in one step
+  async resolveMarkets(
+    resolutions: { market_id: Uuid; outcome: Outcome }[]
+  ): Promise<MarketResolution[]> {
+    return this.request<MarketResolution[]>(
+      "/markets/resolve",
+      "POST",
+      resolutions
+    );
+  }
+
   // orders
   async createOrder(
     marketId: Uuid,
@@ -155,8 +319,58 @@ export class MarketsClient {
   }
 
   // clob
-  async getMarketClob(marketId: Uuid): Promise<MarketClob> {
-    return this.request<MarketClob>(`/markets/${marketId}/clob`, "GET");
+  async getMarketClob(
+    marketId: Uuid,
+    depth: number | null = null,
+    aggregate: "level" | "cumulative" = "level"
+  ): Promise<MarketClob> {
+    const params = new URLSearchParams({ aggregate });
+    if (depth != null) {
+      params.set("depth", depth.toString());
+    }
+
+    return this.request<MarketClob>(
+      `/markets/${marketId}/clob?${params}`,
+      "GET"
+    );
+  }
+
+  async getMarketTop(marketId: Uuid): Promise<MarketTop> {
+    return this.request<MarketTop>(`/markets/${marketId}/top`, "GET");
+  }
+
+  // a snapshot then deltas; on a gap in seq the stream is reopened, which
+  // starts again from a snapshot. returns a function closing the stream
+  streamMarket(
+    marketId: Uuid,
+    onEvent: (event: MarketStreamEvent) => void
+  ): () => void {
+    let source: EventSource;
+    let seq = -1;
+
+    const open = () => {
+      source = new EventSource(`${this.baseURL}/markets/${marketId}/events`);
+
+      const handle = (e: MessageEvent) => {
+        const event: MarketStreamEvent = JSON.parse(e.data);
+
+        if (event.type === "delta" && event.seq !== seq + 1) {
+          source.close();
+          open();
+          return;
+        }
+
+        seq = event.seq;
+        onEvent(event);
+      };
+
+      source.addEventListener("snapshot", handle);
+      source.addEventListener("delta", handle);
+    };
+
+    open();
+
+    return () => source.close();
   }
 }
 
@@ -1,20 +1,74 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import os
+import time
+from array import array
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime
+from itertools import accumulate, islice
+from typing import Literal
+
+import anyio
+from fastapi import (
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Response,
+    WebSocket,
+)
 from fastapi.middleware.cors import CORSMiddleware
-
-from clob import Clob
+from fastapi.responses import StreamingResponse
+from starlette.routing import Mount
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from starlette.websockets import WebSocketState
+
+from candles import Resolution
+from clob import MAX_PRICE, MIN_PRICE
+from engine import Engine
+from events import print_fills
+from exchange import Exchange, OrderInfo, Placed
+from journal import Journal
+from metrics import Histogram
+from seed import price_walks
+from snapshot import Snapshotter
+from stream import Hub
+import journal
+import metrics
+import responses
+import snapshot
 from models import (
+    Leaderboard,
+    LeaderboardEntry,
     Market,
+    MarketBulkCreateInfo,
+    MarketCandle,
+    MarketCandles,
     MarketClob,
     MarketClobOrder,
     MarketCreateInfo,
     MarketList,
+    MarketOrderCreateInfo,
+    MarketResolution,
+    MarketResolveInfo,
+    MarketStreamDelta,
+    MarketStreamSnapshot,
+    MarketTop,
     MarketTrade,
     MarketTrades,
     Order,
     OrderCreateInfo,
+    OrderFill,
+    OrderResult,
+    OUTCOME_PRICES,
+    PriceSeedInfo,
+    ResolveInfo,
     User,
+    UserPortfolio,
+    UserPosition,
     UserTrades,
     Uuid,
+    to_outcome,
 )
 from db import Db, HasId
 
@@ -28,14 +82,356 @@ def get_by_id[T: HasId](db: Db[T], id: Uuid) -> T:
     return v
 
 
+# a market that still takes orders
+def get_open_market(id: Uuid) -> Market:
+    market = get_by_id(MARKETS, id)
+
+    if market.outcome is not None:
+        raise HTTPException(status_code=409, detail="market is resolved")
+
+    return market
+
+
+def to_datetime(ns: int) -> datetime:
+    return datetime.fromtimestamp(ns / 1e9)
+
+
+def to_ns(dt: datetime) -> int:
+    return int(dt.timestamp() * 1e9)
+
+
+def to_order(order: OrderInfo) -> Order:
+    return Order(
+        id=str(order.id),
+        created_at=to_datetime(order.time),
+        user_id=order.user_id,
+        side=order.side,
+        price=order.price,
+        quantity=order.quantity,
+    )
+
+
+def to_result(market_id: Uuid, placed: Placed) -> OrderResult:
+    order = placed.order
+
+    return OrderResult(
+        market_id=market_id,
+        resting_id=str(order.id) if order.quantity > 0 else None,
+        remaining=order.quantity,
+        fills=[OrderFill(price=p, quantity=q) for p, q in placed.fills],
+    )
+
+
+# per level totals, or running totals from the best level outwards
+type Aggregate = Literal["level", "cumulative"]
+
+
 USERS: Db[User] = Db()
 MARKETS: Db[Market] = Db()
-CLOBS: Db[Clob] = Db()
+# books live here unless they are sharded across worker processes
+EXCHANGE = Exchange()
+ENGINE = Engine.local(EXCHANGE)
+JOURNAL: Journal | None = None
+# (market id, depth, aggregate) -> (seq, etag, serialized L2) of the last book
+# served in that shape
+BOOKS: dict[tuple[Uuid, int | None, Aggregate], tuple[int, str, bytes]] = {}
+# seqs restart with the process, so etags carry the boot time too
+BOOT = time.time_ns()
+# market streams, fed by the engine with changes to the markets being followed
+HUB = Hub(int(os.environ.get("MARKETS_STREAM_QUEUE", "1024")))
+ENGINE.listen(HUB.publish)
+# (method, route template) -> request latencies
+REQUESTS: dict[tuple[str, str], Histogram] = {}
+
+# prints fills and renders the book after each order
+debug = os.environ.get("MARKETS_DEBUG", "0") == "1"
+if debug:
+    EXCHANGE.events.subscribe(print_fills)
+
+# match in this many worker processes, markets hash-partitioned between them
+shards = int(os.environ.get("MARKETS_SHARDS", "0"))
+
+# write-ahead journal of market creates, orders and cancels, replayed on startup
+journal_path = os.environ.get("MARKETS_JOURNAL")
+journal_fsync = os.environ.get("MARKETS_JOURNAL_FSYNC", "1") == "1"
+journal_fsync_ms = float(os.environ.get("MARKETS_JOURNAL_FSYNC_MS", "5"))
+
+# point-in-time image of every book, loaded on startup before the journal tail
+snapshot_path = os.environ.get("MARKETS_SNAPSHOT")
+snapshot_interval = float(os.environ.get("MARKETS_SNAPSHOT_INTERVAL", "300"))
+
+
+def print_book(id: Uuid):
+    clob = EXCHANGE.clobs.get(id)
+    if debug and clob:
+        print(clob)
+
+
+# orders are stamped and journaled here, in the order they are sent to the engine
+def place_order(market_id: Uuid, info: OrderCreateInfo) -> asyncio.Future[Placed]:
+    t = time.time_ns()
+    placed = ENGINE.place(
+        market_id, info.user_id, info.side, info.price, info.quantity, t
+    )
+
+    if JOURNAL:
+        JOURNAL.append(
+            journal.encode_order(
+                market_id, info.user_id, info.side, info.price, info.quantity, t
+            )
+        )
+
+    return placed
+
+
+def add_market(market: Market) -> asyncio.Future[None]:
+    MARKETS.insert(market)
+
+    return ENGINE.create_market(market.id, len(MARKETS.store) - 1)
+
+
+async def new_market(info: MarketCreateInfo) -> Market:
+    market = (
+        Market(id=info.id, name=info.name, description=info.description)
+        if info.id
+        else Market(name=info.name, description=info.description)
+    )
+    created = add_market(market)
+
+    if JOURNAL:
+        JOURNAL.append(
+            journal.encode_market(
+                market.id, market.name, market.description, to_ns(market.created_at)
+            )
+        )
+
+    await created
+
+    return market
+
+
+async def seed_markets(markets: list[Market], info: PriceSeedInfo):
+    walks = price_walks(len(markets), info.points, info.start)
+
+    now = time.time_ns()
+    step = int(info.interval * 1e9)
+    times = array("q", (now - step * k for k in range(info.points - 1, -1, -1)))
+    quantities = array("q", [1]) * info.points
+
+    seeded = []
+    for market, walk in zip(markets, walks):
+        prices = array("b", walk.tobytes())
+        seeded.append(ENGINE.seed(market.id, times, prices, quantities))
+
+        if JOURNAL:
+            JOURNAL.append(journal.encode_seed(market.id, times, prices, quantities))
+
+    await asyncio.gather(*seeded)
+
+
+# events are journaled as they are sent to the engine, so ones the engine
+# rejected then fail the same way on replay; they are logged and skipped
+async def replayed(pending: list[asyncio.Future]) -> int:
+    failed = 0
+    for result in await asyncio.gather(*pending, return_exceptions=True):
+        if isinstance(result, Exception):
+            print(f"journal: skipped an event that failed: {result!r}")
+            failed += 1
+
+    return failed
+
+
+# returns the journal size the snapshot is consistent with; with MARKETS_SHARDS
+# every worker loads its own shard snapshot
+async def load_snapshot(path: str) -> int:
+    start = time.perf_counter()
+
+    journal_size, written = snapshot.header(path)
+    if written != shards:
+        raise ValueError(f"{path} was written with MARKETS_SHARDS={written}")
+
+    parts = [snapshot.shard_path(path, i) for i in range(shards)]
+    if not all(
+        os.path.exists(p) and snapshot.header(p)[0] == journal_size for p in parts
+    ):
+        # stopped between the shards' dumps; the journal still has everything
+        print(f"snapshot: shard snapshots do not match {path}, replaying the journal")
+        return 0
+
+    offset = snapshot.load(path, MARKETS, EXCHANGE)
+    if shards:
+        await ENGINE.load_snapshots(path)
+
+    print(
+        f"snapshot: loaded {len(MARKETS.store)} markets"
+        f" in {time.perf_counter() - start:.3f}s"
+    )
+
+    return offset
+
+
+async def recover(journal_path: str | None, snapshot_path: str | None):
+    offset = 0
+
+    if snapshot_path and os.path.exists(snapshot_path):
+        offset = await load_snapshot(snapshot_path)
+
+    if not journal_path:
+        return
+
+    start = time.perf_counter()
+    n = 0
+    failed = 0
+
+    # events are pipelined to the shards and only awaited in chunks
+    pending: list[asyncio.Future] = []
+    for event in journal.replay(journal_path, offset):
+        match event:
+            case (journal.MARKET, id, name, description, created_at):
+                done = add_market(
+                    Market(
+                        id=id,
+                        name=name,
+                        description=description,
+                        created_at=to_datetime(created_at),
+                    )
+                )
+            case (journal.ORDER, market_id, user_id, side, price, quantity, t):
+                done = ENGINE.place(market_id, user_id, side, price, quantity, t)
+            case (journal.CANCEL, market_id, order_id):
+                done = ENGINE.cancel(market_id, order_id)
+            case (journal.SEED, market_id, times, prices, quantities):
+                done = ENGINE.seed(market_id, times, prices, quantities)
+            case (journal.RESOLVE, market_id, price):
+                MARKETS[market_id].outcome = to_outcome(price)
+                done = ENGINE.resolve([(market_id, price)])
+
+        pending.append(done)
+        if len(pending) >= 10_000:
+            failed += await replayed(pending)
+            pending.clear()
+
+        n += 1
+
+    failed += await replayed(pending)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"journal: replayed {n} events in {elapsed:.3f}s"
+        f" ({n / max(elapsed, 1e-9):.0f} events/s), {failed} failed"
+    )
+
+
+async def take_snapshot(snapshotter: Snapshotter):
+    # the snapshot records the journal size, so everything before it must be
+    # on disk for the tail replay to line up
+    if JOURNAL:
+        JOURNAL.flush()
+    journal_size = JOURNAL.size if JOURNAL else 0
+
+    if not shards:
+        snapshotter.start(MARKETS, EXCHANGE, journal_size)
+        return
+
+    # the workers snapshot their books as the call reaches them, behind every
+    # order already sent, and the markets are written here at the same point;
+    # the last round is waited for so the files always come from the same one
+    snapshotter.wait()
+    dumped = ENGINE.start_snapshots(snapshotter.path, journal_size)
+    snapshotter.start(MARKETS, EXCHANGE, journal_size, shards)
+    await dumped
+
+
+async def snapshot_loop(snapshotter: Snapshotter):
+    while True:
+        await asyncio.sleep(snapshot_interval)
+        await take_snapshot(snapshotter)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global ENGINE, JOURNAL
+
+    if shards:
+        ENGINE = Engine.processes(shards, debug)
+        ENGINE.listen(HUB.publish)
+
+    await recover(journal_path, snapshot_path)
+
+    if journal_path:
+        JOURNAL = Journal(
+            journal_path, fsync=journal_fsync, fsync_interval=journal_fsync_ms / 1000
+        )
+
+    if snapshot_path:
+        snapshotter = Snapshotter(snapshot_path)
+        task = asyncio.create_task(snapshot_loop(snapshotter))
+
+    yield
+
+    if JOURNAL:
+        JOURNAL.close()
+
+    if snapshot_path:
+        task.cancel()
+        snapshotter.wait()
+
+        journal_size = JOURNAL.size if JOURNAL else 0
+        if shards:
+            await ENGINE.dump_snapshots(snapshot_path, journal_size)
+        snapshot.dump(snapshot_path, MARKETS, EXCHANGE, journal_size, shards)
+
+    JOURNAL = None
+
+    if shards:
+        ENGINE.close()
+        ENGINE = Engine.local(EXCHANGE)
+        ENGINE.listen(HUB.publish)
+
+
+# records the time until each http response starts, so streams count up to their
+# first byte, against the route template the request matched
+class RequestTimer:
+    app: ASGIApp
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter_ns()
+
+        async def timed_send(message: Message):
+            if message["type"] == "http.response.start":
+                elapsed = time.perf_counter_ns() - start
+
+                key = (scope["method"], route_template(scope))
+                hist = REQUESTS.get(key)
+                if hist is None:
+                    hist = REQUESTS[key] = Histogram()
+                hist.observe(elapsed)
+
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+
+# routers leave the innermost route matched in the scope, with the prefixes of
+# the mounts passed through added to root_path
+def route_template(scope: Scope) -> str:
+    route = scope.get("route")
+    if route is None or isinstance(route, Mount):
+        return "unmatched"
+
+    prefix = scope.get("root_path", "")[len(scope.get("app_root_path", "")) :]
+    return prefix + route.path
 
-debug = True
 
 app = FastAPI(
     debug=debug,
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -45,6 +441,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestTimer)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics() -> Response:
+    stats, markets = await ENGINE.metrics()
+
+    return Response(
+        content=metrics.render(REQUESTS, stats, markets),
+        media_type="text/plain; version=0.0.4",
+    )
 
 
 @app.get("/users/{id}")
@@ -67,63 +474,164 @@ async def create_user() -> User:
 
 
 @app.get("/users/{id}/trades")
-async def users_get_trades(id: Uuid) -> UserTrades:
-    trades: list[MarketTrade] = []
-
-    for c in CLOBS.store.values():
-        for t in c.trades:
-            if t.buy_user_id == id:
-                trades.append(
-                    MarketTrade(
-                        market_id=c.id,
-                        side="bid",
-                        time=t.time,
-                        price=t.price,
-                        quantity=t.quantity,
-                    )
-                )
-            elif t.sell_user_id == id:
-                trades.append(
-                    MarketTrade(
-                        market_id=c.id,
-                        side="ask",
-                        time=t.time,
-                        price=t.price,
-                        quantity=t.quantity,
-                    )
-                )
+async def users_get_trades(
+    id: Uuid,
+    since: datetime | None = None,
+    after: str | None = None,
+    before: str | None = None,
+    limit: int | None = Query(default=None, ge=0),
+) -> UserTrades:
+    try:
+        fills, after, before = await ENGINE.user_trades(
+            id, to_ns(since) if since else None, after, before, limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    trades = [
+        MarketTrade(
+            market_id=f.market_id,
+            side=f.side,
+            time=to_datetime(f.time),
+            price=f.price,
+            quantity=f.quantity,
+        )
+        for f in fills
+    ]
+
+    return UserTrades(user_id=id, trades=trades, after=after, before=before)
+
 
-    trades.sort(key=lambda k: k.time)
-    return UserTrades(user_id=id, trades=trades)
+# read off the ledger kept at fill time, O(markets traded)
+@app.get("/users/{id}/portfolio")
+async def users_get_portfolio(id: Uuid) -> UserPortfolio:
+    portfolio = await ENGINE.portfolio(id)
+
+    return UserPortfolio(
+        user_id=id,
+        cash=portfolio.cash,
+        realized_pnl=sum(h.realized for h in portfolio.holdings),
+        positions=[
+            UserPosition(
+                market_id=h.market_id,
+                quantity=h.quantity,
+                entry_price=h.entry,
+                realized_pnl=h.realized,
+            )
+            for h in portfolio.holdings
+        ],
+    )
+
+
+# every trader's P&L marked to market, the valuation is one numpy pass over all
+# positions per request
+@app.get("/leaderboard")
+async def get_leaderboard(
+    limit: int | None = Query(default=None, ge=0)
+) -> Leaderboard:
+    ranked = await ENGINE.leaderboard(limit)
+
+    return Leaderboard(
+        entries=[
+            LeaderboardEntry(
+                rank=i + 1,
+                user_id=id,
+                pnl=realized + unrealized,
+                realized_pnl=realized,
+                unrealized_pnl=unrealized,
+            )
+            for i, (id, realized, unrealized) in enumerate(ranked)
+        ]
+    )
 
 
 markets = FastAPI()
 app.mount("/markets", markets, name="markets")
 
 
-@markets.get("/")
-async def get_markets(user_id: str | None = None) -> MarketList:
-    markets = MARKETS.store.values()
-
-    if user_id is not None:
-        markets = [m for m in markets if user_id in CLOBS[m.id].users]
+@markets.get("/", response_model=MarketList)
+async def get_markets(
+    user_id: str | None = None,
+    offset: int = Query(default=0, ge=0),
+    limit: int | None = Query(default=None, ge=0),
+) -> Response:
+    if user_id is None:
+        markets = MARKETS.store.values()
+        end = None if limit is None else offset + limit
+        body = responses.market_list(islice(markets, offset, end))
+    else:
+        ids = await ENGINE.user_market_ids(user_id, offset, limit)
+        body = responses.market_list(MARKETS[id] for id in ids)
 
-    return MarketList(markets=list(markets))
+    return Response(content=body, media_type="application/json")
 
 
 @markets.post("/")
 async def create_market(info: MarketCreateInfo) -> Market:
-    market = (
-        Market(id=info.id, name=info.name, description=info.description)
-        if info.id
-        else Market(name=info.name, description=info.description)
-    )
-    clob = Clob(id=market.id)
+    return await new_market(info)
 
-    MARKETS.insert(market)
-    CLOBS.insert(clob)
 
-    return market
+@markets.post("/bulk")
+async def create_markets(info: MarketBulkCreateInfo) -> MarketList:
+    ids = [m.id for m in info.markets if m.id]
+    if len(set(ids)) != len(ids) or any(id in MARKETS.store for id in ids):
+        raise HTTPException(status_code=409, detail="market id already exists")
+
+    created = [await new_market(m) for m in info.markets]
+
+    if info.seed:
+        await seed_markets(created, info.seed)
+
+    return MarketList(markets=created)
+
+
+@markets.post("/orders")
+async def markets_create_orders_many(
+    infos: list[MarketOrderCreateInfo],
+) -> list[OrderResult]:
+    for info in infos:
+        get_open_market(info.market_id)
+
+    placed = await asyncio.gather(*(place_order(i.market_id, i) for i in infos))
+
+    return [to_result(i.market_id, p) for i, p in zip(infos, placed)]
+
+
+# the markets are marked resolved before the engine settles them, so orders that
+# arrive meanwhile are turned away here rather than matched on a dying book
+async def resolve_markets(infos: list[MarketResolveInfo]) -> list[MarketResolution]:
+    ids = [info.market_id for info in infos]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=409, detail="market resolved more than once")
+
+    markets = [get_open_market(id) for id in ids]
+
+    resolutions = [(i.market_id, OUTCOME_PRICES[i.outcome]) for i in infos]
+    settled = ENGINE.resolve(resolutions)
+
+    for market, info in zip(markets, infos):
+        market.outcome = info.outcome
+
+    if JOURNAL:
+        for id, price in resolutions:
+            JOURNAL.append(journal.encode_resolve(id, price))
+
+    return [
+        MarketResolution(
+            market_id=s.market_id,
+            outcome=to_outcome(s.price),
+            cancelled=s.cancelled,
+            positions=s.positions,
+        )
+        for s in await settled
+    ]
+
+
+@markets.post("/resolve")
+async def markets_resolve_many(
+    infos: list[MarketResolveInfo],
+) -> list[MarketResolution]:
+    return await resolve_markets(infos)
 
 
 @markets.get("/{id}")
@@ -133,70 +641,283 @@ async def markets_get(id: Uuid) -> Market:
 
 @markets.post("/{id}/order")
 async def markets_create_order(id: Uuid, info: OrderCreateInfo) -> Order:
-    clob = get_by_id(CLOBS, id)
+    get_open_market(id)
 
-    order = Order(
-        user_id=info.user_id, side=info.side, price=info.price, quantity=info.quantity
-    )
-    clob.insert_order(order)
+    placed = await place_order(id, info)
+
+    print_book(id)
+
+    return to_order(placed.order)
+
+
+# the whole batch is validated up front and goes to the engine as one call,
+# matched in sequence with no other request interleaving
+@markets.post("/{id}/orders")
+async def markets_create_orders(
+    id: Uuid, infos: list[OrderCreateInfo]
+) -> list[OrderResult]:
+    get_open_market(id)
 
-    print(clob)
+    t = time.time_ns()
+    orders = [(i.user_id, i.side, i.price, i.quantity, t) for i in infos]
+    placed = ENGINE.place_many(id, orders)
 
-    return order
+    if JOURNAL:
+        for o in orders:
+            JOURNAL.append(journal.encode_order(id, *o))
+
+    results = [to_result(id, p) for p in await placed]
+
+    print_book(id)
+
+    return results
+
+
+@markets.post("/{id}/resolve")
+async def markets_resolve(id: Uuid, info: ResolveInfo) -> MarketResolution:
+    (resolution,) = await resolve_markets(
+        [MarketResolveInfo(market_id=id, outcome=info.outcome)]
+    )
+
+    return resolution
 
 
 @markets.delete("/{id}/order/{order_id}")
 async def markets_delete_order(id: Uuid, order_id: Uuid) -> Order | None:
-    clob = get_by_id(CLOBS, id)
+    get_by_id(MARKETS, id)
+    # the journal stores order ids as int64
+    if not (order_id.isascii() and order_id.isdigit() and int(order_id) < 2**63):
+        raise HTTPException(status_code=404)
+
+    cancelled = ENGINE.cancel(id, int(order_id))
 
-    order = clob.delete_order(order_id)
+    if JOURNAL:
+        JOURNAL.append(journal.encode_cancel(id, int(order_id)))
+
+    order = await cancelled
     if not order:
         raise HTTPException(status_code=404)
 
-    return order
+    return to_order(order)
+
+
+@markets.get("/{id}/trades", response_model=MarketTrades)
+async def markets_get_trades(
+    id: Uuid,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    after: int | None = Query(default=None, ge=0),
+    before: int | None = Query(default=None, ge=0),
+    limit: int | None = Query(default=None, ge=0),
+) -> Response:
+    get_by_id(MARKETS, id)
+
+    # cursors are tape row numbers; without `after` a limited page is the newest
+    try:
+        tape = await ENGINE.trades(
+            id,
+            to_ns(since) if since else None,
+            to_ns(until) if until else None,
+            after,
+            before,
+            limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
+    return Response(
+        content=responses.market_trades(id, tape), media_type="application/json"
+    )
 
-@markets.get("/{id}/trades")
-async def markets_get_trades(id: Uuid) -> MarketTrades:
-    clob = get_by_id(CLOBS, id)
 
-    trades = [
-        MarketTrade(
-            market_id=id, side=None, time=t.time, price=t.price, quantity=t.quantity
-        )
-        for t in clob.trades
-    ]
+def to_levels(
+    levels: list[tuple[int, int]], aggregate: Aggregate
+) -> list[tuple[int, int]]:
+    if aggregate == "cumulative":
+        prices = [p for p, _ in levels]
+        return list(zip(prices, accumulate(q for _, q in levels)))
 
-    trades.sort(key=lambda k: k.time)
+    return levels
 
-    return MarketTrades(market_id=id, midpoint=clob.midpoint(), trades=trades)
 
+@markets.get("/{id}/candles")
+async def markets_get_candles(
+    id: Uuid,
+    resolution: Resolution = "1m",
+    start: datetime | None = Query(default=None, alias="from"),
+    end: datetime | None = Query(default=None, alias="to"),
+) -> MarketCandles:
+    get_by_id(MARKETS, id)
 
-@markets.get("/{id}/clob")
-async def markets_get_clob(id: Uuid) -> MarketClob:
-    clob = get_by_id(CLOBS, id)
+    candles = await ENGINE.candles(
+        id, resolution, to_ns(start) if start else None, to_ns(end) if end else None
+    )
 
-    bids: list[MarketClobOrder] = []
-    bid = clob.bids.first
-    while bid:
-        bids.append(
-            MarketClobOrder(
-                price=bid.price, quantity=sum(o.quantity for o in bid.orders)
+    return MarketCandles(
+        market_id=id,
+        resolution=resolution,
+        candles=[
+            MarketCandle(
+                time=to_datetime(c.start),
+                open=c.open,
+                high=c.high,
+                low=c.low,
+                close=c.close,
+                volume=c.volume,
+                vwap=c.notional / c.volume if c.volume else c.close,
             )
-        )
+            for c in candles
+        ],
+    )
 
-        bid = bid.succ
 
-    asks: list[MarketClobOrder] = []
-    ask = clob.asks.first
-    while ask:
-        asks.append(
-            MarketClobOrder(
-                price=ask.price, quantity=sum(o.quantity for o in ask.orders)
-            )
+@markets.get("/{id}/clob", response_model=MarketClob)
+async def markets_get_clob(
+    id: Uuid,
+    depth: int | None = Query(default=None, ge=1, le=MAX_PRICE - MIN_PRICE + 1),
+    aggregate: Aggregate = "level",
+    if_none_match: str | None = Header(default=None),
+) -> Response:
+    get_by_id(MARKETS, id)
+
+    # the engine only sends the book back if it moved past the cached seq
+    key = (id, depth, aggregate)
+    cached = BOOKS.get(key)
+    book = await ENGINE.book(id, cached[0] if cached else None, depth)
+
+    if book is not None:
+        bids = to_levels(book.bids, aggregate)
+        asks = to_levels(book.asks, aggregate)
+
+        cached = (
+            book.seq,
+            f'"{BOOT:x}-{book.seq}"',
+            responses.clob(book.midpoint, bids, asks),
         )
+        BOOKS[key] = cached
+
+    _, etag, body = cached
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
 
-        ask = ask.succ
 
-    midpoint = clob.midpoint()
-    return MarketClob(midpoint=midpoint, bids=bids, asks=asks)
+# best bid and ask only, without building the rest of the book
+@markets.get("/{id}/top")
+async def markets_get_top(id: Uuid) -> MarketTop:
+    get_by_id(MARKETS, id)
+
+    top = await ENGINE.top(id)
+
+    return MarketTop(
+        midpoint=top.midpoint,
+        bid=MarketClobOrder(price=top.bid[0], quantity=top.bid[1]) if top.bid else None,
+        ask=MarketClobOrder(price=top.ask[0], quantity=top.ask[1]) if top.ask else None,
+    )
+
+
+# a snapshot, then a delta per change, each tagged with the market's seq; a client
+# seeing a gap in seq should reconnect
+async def follow(id: Uuid) -> AsyncIterator[MarketStreamSnapshot | MarketStreamDelta]:
+    sub, first = HUB.subscribe(id)
+
+    try:
+        if first:
+            await ENGINE.watch(id)
+
+        while True:
+            sub.reset()
+            book = await ENGINE.book(id)
+            seq = book.seq
+
+            yield MarketStreamSnapshot(
+                seq=seq,
+                midpoint=book.midpoint,
+                bids=[MarketClobOrder(price=p, quantity=q) for p, q in book.bids],
+                asks=[MarketClobOrder(price=p, quantity=q) for p, q in book.asks],
+            )
+
+            while True:
+                update = await sub.queue.get()
+
+                # updates were dropped on a full queue, start over from a snapshot
+                if sub.lagged:
+                    break
+
+                if update.seq <= seq:
+                    continue
+
+                seq = update.seq
+                yield MarketStreamDelta(
+                    seq=seq,
+                    midpoint=update.midpoint,
+                    bids=[MarketClobOrder(price=p, quantity=q) for p, q in update.bids],
+                    asks=[MarketClobOrder(price=p, quantity=q) for p, q in update.asks],
+                    trades=[
+                        MarketTrade(
+                            market_id=id,
+                            side=None,
+                            time=to_datetime(t),
+                            price=p,
+                            quantity=q,
+                        )
+                        for t, p, q in update.trades
+                    ],
+                )
+    finally:
+        if HUB.unsubscribe(sub):
+            ENGINE.unwatch(id)
+
+
+@markets.websocket("/{id}/stream")
+async def markets_stream(websocket: WebSocket, id: Uuid):
+    if id not in MARKETS.store:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+
+    # whichever ends first, a disconnect or a failed send, cancels the other so
+    # the subscription is dropped straight away rather than on the next update
+    async with anyio.create_task_group() as tasks:
+
+        async def send():
+            events = follow(id)
+            try:
+                async for event in events:
+                    await websocket.send_text(event.model_dump_json())
+            except Exception:
+                # the client went away mid-send, or the book could not be read
+                pass
+            finally:
+                await events.aclose()
+                tasks.cancel_scope.cancel()
+
+        # clients send nothing, so this only returns once they disconnect
+        async def receive():
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+            tasks.cancel_scope.cancel()
+
+        tasks.start_soon(send)
+        tasks.start_soon(receive)
+
+    if websocket.client_state == WebSocketState.CONNECTED:
+        with suppress(Exception):
+            await websocket.close()
+
+
+# the same stream as server-sent events, for clients without websockets
+@markets.get("/{id}/events")
+async def markets_events(id: Uuid) -> StreamingResponse:
+    get_by_id(MARKETS, id)
+
+    async def events() -> AsyncIterator[str]:
+        async for event in follow(id):
+            data = event.model_dump_json()
+            yield f"id: {event.seq}\nevent: {event.type}\ndata: {data}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -0,0 +1,330 @@
+# In-process matching engine benchmarks. Drives Clob directly with reproducible
+# synthetic order flows and reports throughput, latency percentiles, allocations
+# and memory per resting order.
+#
+#   python bench.py                       # run every flow, print a table
+#   python bench.py --json bench.json     # also write machine-readable results
+#   python bench.py --baseline bench.json # compare, exit 1 on a regression
+
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import tracemalloc
+from array import array
+from collections.abc import Callable, Iterator
+from time import perf_counter_ns
+
+from clob import MAX_PRICE, MIN_PRICE, Clob, Side
+
+NEW = 0
+CANCEL = 1
+
+# (NEW, market, user, side, price, quantity) or (CANCEL, market, order id)
+type Op = tuple
+
+
+# hands out the order ids each Clob will assign, so flows can cancel their own
+# orders without running the engine
+class Ids:
+    next: list[int]
+
+    def __init__(self, markets: int):
+        self.next = [1] * markets
+
+    def new(self, market: int) -> int:
+        id = self.next[market]
+        self.next[market] += 1
+        return id
+
+
+def clamp(price: int) -> int:
+    return max(MIN_PRICE, min(MAX_PRICE, price))
+
+
+# orders around a drifting midpoint, some crossing, with a few cancels
+def random_walk(rng: random.Random, n: int, markets: int = 1) -> Iterator[Op]:
+    ids = Ids(markets)
+    mids = [50] * markets
+    live: list[list[int]] = [[] for _ in range(markets)]
+
+    for _ in range(n):
+        m = rng.randrange(markets)
+
+        if live[m] and rng.random() < 0.1:
+            i = rng.randrange(len(live[m]))
+            live[m][i], live[m][-1] = live[m][-1], live[m][i]
+            yield (CANCEL, m, live[m].pop())
+            continue
+
+        mids[m] = clamp(mids[m] + rng.choice((-1, 0, 1)))
+        side: Side = rng.choice(("bid", "ask"))
+        offset = rng.randint(-2, 6)
+        price = clamp(mids[m] - offset if side == "bid" else mids[m] + offset)
+
+        live[m].append(ids.new(m))
+        yield (NEW, m, rng.randrange(100), side, price, rng.randint(1, 10))
+
+
+# one maker cancelling and re-quoting both sides every step, takers trading
+# against the quotes in between
+def market_maker(rng: random.Random, n: int) -> Iterator[Op]:
+    ids = Ids(1)
+    mid = 50
+    quotes: list[int] = []
+    done = 0
+
+    while done < n:
+        for id in quotes:
+            yield (CANCEL, 0, id)
+        done += len(quotes)
+
+        mid = clamp(mid + rng.choice((-1, 0, 1)))
+        quotes = [ids.new(0), ids.new(0)]
+        yield (NEW, 0, 0, "bid", clamp(mid - 1), 20)
+        yield (NEW, 0, 0, "ask", clamp(mid + 1), 20)
+        done += 2
+
+        for _ in range(rng.randint(0, 3)):
+            side: Side = rng.choice(("bid", "ask"))
+            price = clamp(mid + 1) if side == "bid" else clamp(mid - 1)
+            ids.new(0)
+            yield (NEW, 0, rng.randint(1, 50), side, price, rng.randint(1, 5))
+            done += 1
+
+
+# a deep non-crossing book, then every order cancelled in random order
+def cancel_storm(rng: random.Random, n: int) -> Iterator[Op]:
+    ids = Ids(1)
+    resting = []
+
+    for _ in range(n // 2):
+        side: Side = rng.choice(("bid", "ask"))
+        price = rng.randint(1, 49) if side == "bid" else rng.randint(51, 99)
+        resting.append(ids.new(0))
+        yield (NEW, 0, rng.randrange(100), side, price, rng.randint(1, 10))
+
+    rng.shuffle(resting)
+    for id in resting:
+        yield (CANCEL, 0, id)
+
+
+# asks stacked over many levels, swept by large bids, then stacked again. The
+# bids add up to exactly what was stacked, so every round sweeps a full book and
+# leaves it empty
+def deep_sweep(rng: random.Random, n: int) -> Iterator[Op]:
+    done = 0
+
+    while done < n:
+        stacked = 0
+        for price in range(51, MAX_PRICE + 1):
+            for _ in range(20):
+                user = rng.randrange(100)
+                quantity = rng.randint(1, 10)
+                stacked += quantity
+                yield (NEW, 0, user, "ask", price, quantity)
+                done += 1
+
+        for i in range(10):
+            yield (NEW, 0, 0, "bid", MAX_PRICE, stacked // 10 + (i < stacked % 10))
+            done += 1
+
+
+def many_markets(rng: random.Random, n: int) -> Iterator[Op]:
+    return random_walk(rng, n, markets=10_000)
+
+
+FLOWS: dict[str, tuple[Callable[[random.Random, int], Iterator[Op]], int]] = {
+    "random_walk": (random_walk, 1),
+    "market_maker": (market_maker, 1),
+    "cancel_storm": (cancel_storm, 1),
+    "deep_sweep": (deep_sweep, 1),
+    "many_markets": (many_markets, 10_000),
+}
+
+
+def percentile(sorted_ns: list[int], q: float) -> int:
+    if not sorted_ns:
+        return 0
+
+    return sorted_ns[min(len(sorted_ns) - 1, int(q * len(sorted_ns)))]
+
+
+def run(ops: list[Op], markets: int) -> dict:
+    clobs = [Clob(f"m{i}") for i in range(markets)]
+    inserts = array("q")
+    cancels = array("q")
+
+    gc.collect()
+    collections = gc.get_stats()[0]["collections"]
+    blocks = sys.getallocatedblocks()
+
+    start = perf_counter_ns()
+    for op in ops:
+        if op[0] == NEW:
+            _, m, user, side, price, quantity = op
+            clob = clobs[m]
+
+            t = perf_counter_ns()
+            clob.insert_order(clob.new_order(user, side, price, quantity, 0))
+            inserts.append(perf_counter_ns() - t)
+        else:
+            clob = clobs[op[1]]
+
+            t = perf_counter_ns()
+            clob.delete_order(op[2])
+            cancels.append(perf_counter_ns() - t)
+    elapsed = perf_counter_ns() - start
+
+    resting = sum(len(clob.orders) for clob in clobs)
+    inserts = sorted(inserts)
+    cancels = sorted(cancels)
+
+    return {
+        "ops": len(ops),
+        "seconds": elapsed / 1e9,
+        "ops_per_sec": len(ops) / (elapsed / 1e9),
+        "inserts": len(inserts),
+        "insert_p50_ns": percentile(inserts, 0.5),
+        "insert_p99_ns": percentile(inserts, 0.99),
+        "insert_p999_ns": percentile(inserts, 0.999),
+        "cancels": len(cancels),
+        "cancel_p50_ns": percentile(cancels, 0.5),
+        "cancel_p99_ns": percentile(cancels, 0.99),
+        "cancel_p999_ns": percentile(cancels, 0.999),
+        "trades": sum(len(clob.trades) for clob in clobs),
+        "resting": resting,
+        # net blocks still allocated at the end, and gen 0 collections as a
+        # measure of allocation churn
+        "alloc_blocks": sys.getallocatedblocks() - blocks,
+        "gc_gen0": gc.get_stats()[0]["collections"] - collections,
+    }
+
+
+# traced heap growth of a book holding n resting orders, per order
+def memory_per_order(n: int, seed: int) -> float:
+    rng = random.Random(seed)
+    clob = Clob("memory")
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    for _ in range(n):
+        side: Side = rng.choice(("bid", "ask"))
+        price = rng.randint(1, 49) if side == "bid" else rng.randint(51, 99)
+        clob.insert_order(clob.new_order(rng.randrange(100), side, price, 1, 0))
+
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return (after - before) / n
+
+
+# metric -> True if higher is better
+COMPARED = {
+    "ops_per_sec": True,
+    "insert_p99_ns": False,
+    "cancel_p99_ns": False,
+}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+
+    rows = [
+        (name, metric, base[metric], results["flows"][name][metric], higher)
+        for name, base in baseline["flows"].items()
+        if name in results["flows"]
+        for metric, higher in COMPARED.items()
+    ]
+    rows.append(
+        (
+            "memory",
+            "bytes_per_order",
+            baseline["memory"]["bytes_per_order"],
+            results["memory"]["bytes_per_order"],
+            False,
+        )
+    )
+
+    print(f"\n{'flow':<14} {'metric':<16} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name, metric, old, new, higher in rows:
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher else change
+        flag = ""
+        if worse > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(f"{name} {metric}")
+
+        print(
+            f"{name:<14} {metric:<16} {old:>12.0f} {new:>12.0f} {change:>+8.1%}{flag}"
+        )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="matching engine benchmarks")
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--flow", action="append", choices=list(FLOWS))
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against results from --json")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="fraction a metric may get worse by before it counts as a regression",
+    )
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seed": args.seed,
+        "orders": args.orders,
+        "flows": {},
+    }
+
+    print(
+        f"{'flow':<14} {'ops/s':>10} {'ins p50':>8} {'p99':>8} {'p999':>8}"
+        f" {'can p50':>8} {'p99':>8} {'p999':>8} {'blocks':>9} {'gc0':>6}"
+    )
+    for name in args.flow or FLOWS:
+        flow, markets = FLOWS[name]
+        ops = list(flow(random.Random(args.seed), args.orders))
+        r = results["flows"][name] = run(ops, markets)
+
+        print(
+            f"{name:<14} {r['ops_per_sec']:>10.0f} {r['insert_p50_ns']:>8}"
+            f" {r['insert_p99_ns']:>8} {r['insert_p999_ns']:>8}"
+            f" {r['cancel_p50_ns']:>8} {r['cancel_p99_ns']:>8}"
+            f" {r['cancel_p999_ns']:>8} {r['alloc_blocks']:>9} {r['gc_gen0']:>6}"
+        )
+
+    resting = min(args.orders, 100_000)
+    results["memory"] = {
+        "resting_orders": resting,
+        "bytes_per_order": memory_per_order(resting, args.seed),
+    }
+    print(f"\nmemory: {results['memory']['bytes_per_order']:.0f} B per resting order")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left
+from typing import Literal, NamedTuple
+
+type Resolution = Literal["1m", "1h", "1d"]
+
+MINUTE = 60 * 10**9
+
+# bucket width in ns, finest first; each resolution is rolled up from the one
+# before it
+RESOLUTIONS: dict[Resolution, int] = {
+    "1m": MINUTE,
+    "1h": 60 * MINUTE,
+    "1d": 24 * 60 * MINUTE,
+}
+
+
+class Candle(NamedTuple):
+    # bucket start, ns since epoch
+    start: int
+    open: int
+    high: int
+    low: int
+    close: int
+    volume: int
+    # sum of price * quantity, for the vwap
+    notional: int
+
+    def merge(self, c: Candle) -> Candle:
+        return Candle(
+            self.start,
+            self.open,
+            max(self.high, c.high),
+            min(self.low, c.low),
+            c.close,
+            self.volume + c.volume,
+            self.notional + c.notional,
+        )
+
+
+# candles of one width, column per field, in bucket order
+class Series:
+    width: int
+    start: array[int]
+    open: array[int]
+    high: array[int]
+    low: array[int]
+    close: array[int]
+    volume: array[int]
+    notional: array[int]
+
+    def __init__(self, width: int):
+        self.width = width
+        self.start = array("q")
+        self.open = array("b")
+        self.high = array("b")
+        self.low = array("b")
+        self.close = array("b")
+        self.volume = array("q")
+        self.notional = array("q")
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def __getitem__(self, i: int) -> Candle:
+        return Candle(
+            self.start[i],
+            self.open[i],
+            self.high[i],
+            self.low[i],
+            self.close[i],
+            self.volume[i],
+            self.notional[i],
+        )
+
+    # folds a finer candle in, returning the candle it closed if it opened a new
+    # bucket
+    def merge(self, c: Candle) -> Candle | None:
+        start = c.start - c.start % self.width
+
+        if self.start and self.start[-1] == start:
+            self.high[-1] = max(self.high[-1], c.high)
+            self.low[-1] = min(self.low[-1], c.low)
+            self.close[-1] = c.close
+            self.volume[-1] += c.volume
+            self.notional[-1] += c.notional
+            return None
+
+        closed = self[-1] if self.start else None
+
+        self.start.append(start)
+        self.open.append(c.open)
+        self.high.append(c.high)
+        self.low.append(c.low)
+        self.close.append(c.close)
+        self.volume.append(c.volume)
+        self.notional.append(c.notional)
+
+        return closed
+
+
+# OHLCV buckets of one market's trades, kept up to date as trades are appended.
+# A finer bucket is rolled into the next resolution once it closes, so the last
+# bucket of every series is still open and reads fold those in
+class Candles:
+    series: list[Series]
+
+    def __init__(self):
+        self.series = [Series(w) for w in RESOLUTIONS.values()]
+
+    def add(self, time: int, price: int, quantity: int):
+        c = Candle(time, price, price, price, price, quantity, price * quantity)
+
+        for series in self.series:
+            c = series.merge(c)
+            if c is None:
+                return
+
+    # buckets starting in [start, end)
+    def get(
+        self, resolution: Resolution, start: int | None = None, end: int | None = None
+    ) -> list[Candle]:
+        level = list(RESOLUTIONS).index(resolution)
+        series = self.series[level]
+        width = series.width
+
+        lo = 0 if start is None else bisect_left(series.start, start - start % width)
+        hi = len(series) if end is None else bisect_left(series.start, end, lo)
+        out = [series[i] for i in range(lo, hi)]
+
+        # the open buckets of the finer series, oldest first
+        for finer in reversed(self.series[:level]):
+            if not finer:
+                continue
+
+            c = finer[-1]
+            bucket = c.start - c.start % width
+            if start is not None and bucket < start - start % width:
+                continue
+            if end is not None and bucket >= end:
+                continue
+
+            if out and out[-1].start == bucket:
+                out[-1] = out[-1].merge(c)
+            else:
+                out.append(c._replace(start=bucket))
+
+        return out
@@ -1,10 +1,25 @@
 from __future__ import annotations
 
-from datetime import datetime
+from array import array
+from time import perf_counter_ns, time_ns
+from collections.abc import Iterator
 from enum import Enum
-from pydantic.dataclasses import dataclass
+from typing import Literal
 
-from models import Order, Uuid
+from events import (
+    Accepted,
+    BookChanged,
+    Cancelled,
+    EventRing,
+    Fill,
+    LevelChanged,
+    Resolved,
+)
+from metrics import BookStats
+from tape import NO_USER, TradeTape
+
+
+type Side = Literal["bid", "ask"]
 
 
 class PriceOrder(Enum):
@@ -12,178 +27,455 @@ class PriceOrder(Enum):
     DESC = -1
 
 
-@dataclass
-class OrderPrice:
-    pred: OrderPrice | None
-    succ: OrderPrice | None
+MIN_PRICE = 0
+MAX_PRICE = 100
+
+
+def check_price(price: int):
+    if not MIN_PRICE <= price <= MAX_PRICE:
+        raise ValueError(f"price must be between {MIN_PRICE} and {MAX_PRICE}")
+
+
+# small enough that price * quantity and the running totals built from it (cash,
+# candle volume and notional) stay well inside int64
+MAX_QUANTITY = 2**31 - 1
+
+
+def check_quantity(quantity: int):
+    if not 0 < quantity <= MAX_QUANTITY:
+        raise ValueError(f"quantity must be between 1 and {MAX_QUANTITY}")
 
+
+# engine-side order; resting orders double as nodes of their level's FIFO
+class LimitOrder:
+    __slots__ = (
+        "id",
+        "user",
+        "side",
+        "price",
+        "quantity",
+        "time",
+        "level",
+        "prev",
+        "next",
+    )
+
+    id: int
+    # index into the user id interner
+    user: int
+    side: Side
     price: int
-    orders: list[Order]
+    quantity: int
+    # ns since epoch
+    time: int
+
+    level: OrderPrice | None
+    prev: LimitOrder | None
+    next: LimitOrder | None
 
+    def __init__(
+        self, id: int, user: int, side: Side, price: int, quantity: int, time: int
+    ):
+        self.id = id
+        self.user = user
+        self.side = side
+        self.price = price
+        self.quantity = quantity
+        self.time = time
+        self.level = None
+        self.prev = None
+        self.next = None
+
+
+# FIFO of the orders resting at one price, oldest at the head
+class OrderPrice:
+    __slots__ = ("price", "quantity", "head", "tail")
 
-class OrderPriceList:
-    first: OrderPrice | None
-    last: OrderPrice | None
+    price: int
+    # total remaining over the orders in the queue
+    quantity: int
+    head: LimitOrder | None
+    tail: LimitOrder | None
+
+    def __init__(self, price: int):
+        self.price = price
+        self.quantity = 0
+        self.head = None
+        self.tail = None
+
+    def __iter__(self) -> Iterator[LimitOrder]:
+        order = self.head
+        while order:
+            yield order
+            order = order.next
+
+    def append(self, order: LimitOrder):
+        order.level = self
+        self.quantity += order.quantity
+
+        if self.tail:
+            order.prev = self.tail
+            self.tail.next = order
+        else:
+            self.head = order
+
+        self.tail = order
+
+    def unlink(self, order: LimitOrder):
+        self.quantity -= order.quantity
+
+        if order.prev:
+            order.prev.next = order.next
+        else:
+            self.head = order.next
+
+        if order.next:
+            order.next.prev = order.prev
+        else:
+            self.tail = order.prev
+
+        order.level = order.prev = order.next = None
+
+
+class PriceLadder:
+    # one slot per tick, indexed by price
+    levels: list[OrderPrice | None]
+    # price of the best non-empty level
+    best: int | None
+    # non-empty levels
+    depth: int
     sort: PriceOrder
 
     def __init__(self, sort: PriceOrder):
-        self.first = None
-        self.last = None
+        self.levels = [None] * (MAX_PRICE - MIN_PRICE + 1)
+        self.best = None
+        self.depth = 0
         self.sort = sort
 
-    def clean_orders(self):
-        head = self.first
-        while head:
-            if not head.orders:
-                if head.succ:
-                    head.succ.pred = head.pred
-                else:
-                    self.last = head.pred
-                if head.pred:
-                    head.pred.succ = head.succ
-                else:
-                    self.first = head.succ
-
-            head = head.succ
+    @property
+    def first(self) -> OrderPrice | None:
+        if self.best is None:
+            return None
 
-    def get_order_price(self, order: Order) -> OrderPrice:
-        head = self.first
+        return self.levels[self.best - MIN_PRICE]
 
-        price = order.price * self.sort.value
+    def __iter__(self) -> Iterator[OrderPrice]:
+        if self.best is None:
+            return
 
-        while True:
-            if not head:
-                node = OrderPrice(self.last, None, order.price, [])
+        step = self.sort.value
+        stop = MAX_PRICE + 1 if step > 0 else MIN_PRICE - 1
+        for price in range(self.best, stop, step):
+            node = self.levels[price - MIN_PRICE]
+            if node is not None:
+                yield node
 
-                if not self.first:
-                    self.first = node
+    def __reversed__(self) -> Iterator[OrderPrice]:
+        if self.best is None:
+            return
 
-                if self.last:
-                    self.last.succ = node
+        step = -self.sort.value
+        start = MAX_PRICE if step < 0 else MIN_PRICE
+        for price in range(start, self.best + step, step):
+            node = self.levels[price - MIN_PRICE]
+            if node is not None:
+                yield node
 
-                self.last = node
+    # total resting at a price, 0 if the level is empty
+    def quantity(self, price: int) -> int:
+        node = self.levels[price - MIN_PRICE]
 
-                return node
+        return node.quantity if node else 0
 
-            head_price = head.price * self.sort.value
-            if head_price > price:
-                node = OrderPrice(None, head, order.price, [])
+    def get_order_price(self, order: LimitOrder) -> OrderPrice:
+        node = self.levels[order.price - MIN_PRICE]
+        if node is not None:
+            return node
 
-                if head.pred:
-                    node.pred = head.pred
-                    head.pred.succ = node
-                else:
-                    self.first = node
+        node = OrderPrice(order.price)
+        self.levels[order.price - MIN_PRICE] = node
+        self.depth += 1
 
-                head.pred = node
+        if self.best is None or (
+            order.price * self.sort.value < self.best * self.sort.value
+        ):
+            self.best = order.price
 
-                return node
-            elif head_price == price:
-                return head
+        return node
 
-            head = head.succ
+    def remove(self, node: OrderPrice):
+        self.levels[node.price - MIN_PRICE] = None
+        self.depth -= 1
 
+        if node.price != self.best:
+            return
 
-@dataclass
-class Trade:
-    buy_user_id: str
-    sell_user_id: str
-    time: datetime
-    price: int
-    quantity: int
+        self.best = None
+        step = self.sort.value
+        stop = MAX_PRICE + 1 if step > 0 else MIN_PRICE - 1
+        for price in range(node.price + step, stop, step):
+            if self.levels[price - MIN_PRICE] is not None:
+                self.best = price
+                return
 
 
 class Clob:
     # market id
-    id: Uuid
+    id: str
 
-    users: set[str]
+    # interned user indices
+    users: set[int]
 
-    bids: OrderPriceList
-    asks: OrderPriceList
+    bids: PriceLadder
+    asks: PriceLadder
 
-    trades: list[Trade]
+    trades: TradeTape
 
-    orders: dict[Uuid, OrderPrice]
+    orders: dict[int, LimitOrder]
+    next_order_id: int
 
-    def __init__(self, id: Uuid):
-        self.id = id
-        self.users = set()
-        self.bids = OrderPriceList(PriceOrder.DESC)
-        self.asks = OrderPriceList(PriceOrder.ASC)
-        self.orders = {}
-        self.trades = []
+    # bumped on every change to the book or the trade tape
+    seq: int
 
-    def _add_order(self, order: Order, price_list: OrderPriceList):
-        price_node = price_list.get_order_price(order)
+    # where changes are reported, if anyone is listening
+    events: EventRing | None
+    # order counts and matching times, if recorded
+    stats: BookStats | None
 
-        price_node.orders.append(order)
+    # what each contract paid out once the market resolved; no orders are taken
+    # after that
+    settled: int | None
 
+    def __init__(
+        self, id: str, events: EventRing | None = None, stats: BookStats | None = None
+    ):
+        self.id = id
+        self.users = set()
+        self.bids = PriceLadder(PriceOrder.DESC)
+        self.asks = PriceLadder(PriceOrder.ASC)
+        self.orders = {}
+        self.next_order_id = 1
+        self.trades = TradeTape()
+        self.seq = 0
+        self.events = events
+        self.stats = stats
+        self.settled = None
+
+    def _add_order(self, order: LimitOrder, price_list: PriceLadder):
         assert order.id not in self.orders
-        self.orders[order.id] = price_node
+
+        price_list.get_order_price(order).append(order)
+        self.orders[order.id] = order
 
     def __repr__(self) -> str:
         s = ""
 
-        ask = self.asks.last
-        while ask:
-            s += f"{ask.price: >4} : {[o.quantity for o in ask.orders]}\n"
-            ask = ask.pred
+        for ask in reversed(self.asks):
+            s += f"{ask.price: >4} : {[o.quantity for o in ask]}\n"
 
         s += "-------------\n"
 
-        bid = self.bids.first
-        while bid:
-            s += f"{bid.price: >4} : {[o.quantity for o in bid.orders]}\n"
-            bid = bid.succ
+        for bid in self.bids:
+            s += f"{bid.price: >4} : {[o.quantity for o in bid]}\n"
 
         return s
 
-    def delete_order(self, id: Uuid) -> Order | None:
-        node = self.orders.get(id)
-        if not node:
+    def new_order(
+        self, user: int, side: Side, price: int, quantity: int, time: int | None = None
+    ) -> LimitOrder:
+        check_price(price)
+        check_quantity(quantity)
+        if self.settled is not None:
+            raise ValueError("market is resolved")
+
+        order = LimitOrder(
+            self.next_order_id,
+            user,
+            side,
+            price,
+            quantity,
+            time if time is not None else time_ns(),
+        )
+        self.next_order_id += 1
+
+        return order
+
+    def delete_order(self, id: int) -> LimitOrder | None:
+        order = self.orders.pop(id, None)
+        if not order:
             return None
 
-        del self.orders[id]
+        self.seq += 1
+        if self.stats is not None:
+            self.stats.cancels += 1
 
-        idx = [o.id for o in node.orders].index(id)
-        order = node.orders.pop(idx)
+        level = order.level
+        level.unlink(order)
 
-        self._clean_orders()
+        if level.head is None:
+            match order.side:
+                case "bid":
+                    self.bids.remove(level)
+                case "ask":
+                    self.asks.remove(level)
+
+        if self.events is not None and self.events.active:
+            events = self.events
+            events.push(
+                Cancelled(
+                    self.id, self.seq, order.id, order.side, order.price, order.quantity
+                )
+            )
+            events.push(
+                LevelChanged(self.id, self.seq, order.side, order.price, level.quantity)
+            )
+            events.push(BookChanged(self.id, self.seq, self.midpoint()))
 
         return order
 
-    def insert_order(self, order: Order):
-        self.users.add(order.user_id)
+    # returns the trade tape indices of the fills
+    def insert_order(self, order: LimitOrder) -> range:
+        stats = self.stats
+        if stats is not None:
+            start = perf_counter_ns()
 
-        self._process_order(order)
+        self.users.add(order.user)
+        self.seq += 1
 
-        if order.quantity == 0:
-            return
+        fills = self._process_order(order)
+
+        if order.quantity > 0:
+            match order.side:
+                case "bid":
+                    self._add_order(order, self.bids)
+                case "ask":
+                    self._add_order(order, self.asks)
+
+        if stats is not None:
+            stats.matching.observe(perf_counter_ns() - start)
+            stats.orders += 1
+            stats.fills += len(fills)
+
+        if self.events is not None and self.events.active:
+            self._emit_order(order, fills)
+
+        return fills
+
+    def _emit_order(self, order: LimitOrder, fills: range):
+        events = self.events
+        tape = self.trades
+        id = self.id
+        seq = self.seq
+
+        events.push(
+            Accepted(
+                id,
+                seq,
+                order.id,
+                order.user,
+                order.side,
+                order.price,
+                order.quantity,
+                order.time,
+            )
+        )
+
+        for i in fills:
+            events.push(
+                Fill(
+                    id,
+                    seq,
+                    tape.time[i],
+                    tape.price[i],
+                    tape.quantity[i],
+                    tape.buyer[i],
+                    tape.seller[i],
+                )
+            )
 
         match order.side:
             case "bid":
-                self._add_order(order, self.bids)
+                own, other, other_side = self.bids, self.asks, "ask"
             case "ask":
-                self._add_order(order, self.asks)
+                own, other, other_side = self.asks, self.bids, "bid"
 
-    def on_order_fill(self, order: Order, price: int, fill: int):
-        # TODO:
-        print(
-            f"Order {order.id} ({order.side}): filled {fill} @ {price} (limit={order.price})"
-        )
+        # the levels matched against, in the order they were swept
+        for price in dict.fromkeys(tape.price[i] for i in fills):
+            events.push(
+                LevelChanged(id, seq, other_side, price, other.quantity(price))
+            )
+
+        if order.quantity > 0:
+            events.push(
+                LevelChanged(
+                    id, seq, order.side, order.price, own.quantity(order.price)
+                )
+            )
 
-    def _clean_orders(self):
-        self.bids.clean_orders()
-        self.asks.clean_orders()
+        events.push(BookChanged(id, seq, self.midpoint()))
+
+    # settles the market: every resting order is dropped with its ladder rather
+    # than cancelled one by one, the tape stays readable. Returns the number of
+    # orders dropped
+    def resolve(self, price: int) -> int:
+        check_price(price)
+        if self.settled is not None:
+            raise ValueError("market is already resolved")
+
+        bids = [level.price for level in self.bids]
+        asks = [level.price for level in self.asks]
+        cancelled = len(self.orders)
+
+        self.bids = PriceLadder(PriceOrder.DESC)
+        self.asks = PriceLadder(PriceOrder.ASC)
+        self.orders = {}
+        self.settled = price
+        self.seq += 1
+
+        if self.stats is not None:
+            self.stats.cancels += cancelled
+
+        if self.events is not None and self.events.active:
+            events = self.events
+            for side, prices in (("bid", bids), ("ask", asks)):
+                for p in prices:
+                    events.push(LevelChanged(self.id, self.seq, side, p, 0))
+            events.push(Resolved(self.id, self.seq, price, cancelled))
+            events.push(BookChanged(self.id, self.seq, None))
+
+        return cancelled
+
+    # appends trades with no counterparties, e.g. seeded history
+    def seed(self, time: array[int], price: array[int], quantity: array[int]):
+        tape = self.trades
+        start = len(tape)
+
+        tape.extend(time, price, quantity)
+        self.seq += 1
+
+        if self.events is not None and self.events.active:
+            events = self.events
+            for i in range(start, len(tape)):
+                events.push(
+                    Fill(
+                        self.id,
+                        self.seq,
+                        tape.time[i],
+                        tape.price[i],
+                        tape.quantity[i],
+                        NO_USER,
+                        NO_USER,
+                    )
+                )
+            events.push(BookChanged(self.id, self.seq, self.midpoint()))
 
     def midpoint(self) -> float | None:
-        if self.bids.first and self.asks.first:
-            return (self.bids.first.price + self.asks.first.price) / 2
+        if self.bids.best is not None and self.asks.best is not None:
+            return (self.bids.best + self.asks.best) / 2
 
         return None
 
-    def _process_order(self, order: Order):
+    def _process_order(self, order: LimitOrder) -> range:
         match order.side:
             case "bid":
                 price_list = self.asks
@@ -192,42 +484,39 @@ class Clob:
                 price_list = self.bids
                 price_mul = -1
 
-        node = price_list.first
-
+        trades = self.trades
+        start = len(trades)
         price = order.price * price_mul
+        # fills are stamped with the order time so journal replay is deterministic
+        now = order.time
 
-        while node:
-            node_price = node.price * price_mul
-            if node_price > price:
+        while order.quantity > 0 and (level := price_list.first):
+            if level.price * price_mul > price:
                 break
 
-            counter = node.orders[0]
-
-            size = min(order.quantity, counter.quantity)
+            # consume resting orders from the head until either side runs out
+            while order.quantity > 0 and (counter := level.head):
+                size = min(order.quantity, counter.quantity)
 
-            order.quantity -= size
-            counter.quantity -= size
-
-            match order.side:
-                case "bid":
-                    buy_user = order.user_id
-                    sell_user = counter.user_id
-                case "ask":
-                    buy_user = counter.user_id
-                    sell_user = order.user_id
+                order.quantity -= size
+                counter.quantity -= size
+                level.quantity -= size
 
-            self.trades.append(
-                Trade(buy_user, sell_user, datetime.now(), counter.price, size)
-            )
-            self.on_order_fill(order, counter.price, size)
-            self.on_order_fill(counter, counter.price, size)
+                match order.side:
+                    case "bid":
+                        buy_user = order.user
+                        sell_user = counter.user
+                    case "ask":
+                        buy_user = counter.user
+                        sell_user = order.user
 
-            if counter.quantity == 0:
-                _ = self.delete_order(counter.id)
+                trades.append(buy_user, sell_user, now, level.price, size)
 
-            if order.quantity == 0:
-                return
+                if counter.quantity == 0:
+                    level.unlink(counter)
+                    del self.orders[counter.id]
 
-            node = node.succ
+            if level.head is None:
+                price_list.remove(level)
 
-        self._clean_orders()
+        return range(start, len(trades))
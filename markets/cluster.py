@@ -0,0 +1,421 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import os
+import uuid
+from bisect import bisect
+from collections.abc import Callable
+from contextlib import asynccontextmanager
+from datetime import datetime
+from itertools import islice
+from typing import Any
+
+import httpx
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from models import (
+    Leaderboard,
+    LeaderboardEntry,
+    Market,
+    MarketBulkCreateInfo,
+    MarketCreateInfo,
+    MarketList,
+    MarketOrderCreateInfo,
+    MarketResolution,
+    MarketResolveInfo,
+    OrderResult,
+    User,
+    UserPortfolio,
+    UserTrades,
+    Uuid,
+)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest())
+
+
+# consistent hash ring over the node urls; each node is placed at many points so
+# markets spread evenly and adding a node only moves the markets it takes over
+class Ring:
+    nodes: list[str]
+    hashes: list[int]
+    owners: list[str]
+
+    def __init__(self, nodes: list[str], replicas: int = 128):
+        points = sorted(
+            (_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas)
+        )
+
+        self.nodes = nodes
+        self.hashes = [h for h, _ in points]
+        self.owners = [node for _, node in points]
+
+    def owner(self, key: str) -> str:
+        return self.owners[bisect(self.hashes, _hash(key)) % len(self.hashes)]
+
+
+# comma separated base urls of the markets nodes, e.g. http://localhost:8001
+nodes = [n.strip().rstrip("/") for n in os.environ["MARKETS_NODES"].split(",")]
+
+RING = Ring(nodes)
+CLIENT: httpx.AsyncClient | None = None
+# new users are spread round robin, lookups ask every node
+USER_NODES = itertools.cycle(nodes)
+
+# passed through both ways when proxying a market request
+FORWARDED_HEADERS = ("content-type", "if-none-match", "etag", "cache-control")
+
+# separates the per-node parts of the user trades cursors
+CURSOR_SEP = ","
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global CLIENT
+
+    CLIENT = httpx.AsyncClient(timeout=30)
+
+    yield
+
+    await CLIENT.aclose()
+    CLIENT = None
+
+
+async def call(
+    node: str, method: str, path: str, json: Any = None, params: Any = None
+) -> Any:
+    r = await CLIENT.request(method, f"{node}{path}", json=json, params=params)
+
+    if r.status_code >= 400:
+        raise HTTPException(status_code=r.status_code, detail=r.json().get("detail"))
+
+    return r.json()
+
+
+async def fan_out(method: str, path: str, params: Any = None) -> list[Any]:
+    return await asyncio.gather(
+        *(call(node, method, path, params=params) for node in RING.nodes)
+    )
+
+
+def group_by_owner[T](items: list[T], key: Callable[[T], str]) -> dict[str, list[int]]:
+    groups: dict[str, list[int]] = {}
+    for i, item in enumerate(items):
+        groups.setdefault(RING.owner(key(item)), []).append(i)
+
+    return groups
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+@app.get("/users/{id}")
+async def get_user(id: Uuid) -> User:
+    rs = await asyncio.gather(
+        *(CLIENT.get(f"{node}/users/{id}") for node in RING.nodes)
+    )
+
+    for r in rs:
+        if r.status_code == 200:
+            return User.model_validate(r.json())
+
+    raise HTTPException(status_code=404)
+
+
+@app.post("/users")
+async def create_user() -> User:
+    return User.model_validate(await call(next(USER_NODES), "POST", "/users"))
+
+
+# each node keeps its own cursors; a node's page is only partly used when other
+# nodes have trades nearer the cursor, so its cursors for the part used are
+# fetched again
+@app.get("/users/{id}/trades")
+async def users_get_trades(
+    id: Uuid,
+    since: datetime | None = None,
+    after: str | None = None,
+    before: str | None = None,
+    limit: int | None = Query(default=None, ge=0),
+) -> UserTrades:
+    def split(cursor: str | None) -> list[str | None]:
+        if not cursor:
+            return [None] * len(RING.nodes)
+
+        parts = cursor.split(CURSOR_SEP)
+        if len(parts) != len(RING.nodes):
+            raise HTTPException(
+                status_code=422, detail="cursor does not match the nodes"
+            )
+
+        return parts
+
+    afters = split(after)
+    befores = split(before)
+
+    def params(i: int, limit: int | None) -> dict:
+        p = {
+            "since": since.isoformat() if since else None,
+            "after": afters[i],
+            "before": befores[i],
+            "limit": limit,
+        }
+
+        return {k: v for k, v in p.items() if v is not None}
+
+    async def fetch(i: int, limit: int | None) -> UserTrades:
+        page = await call(
+            RING.nodes[i], "GET", f"/users/{id}/trades", params=params(i, limit)
+        )
+
+        return UserTrades.model_validate(page)
+
+    pages = await asyncio.gather(*(fetch(i, limit) for i in range(len(RING.nodes))))
+    keyed = [[(t.time, i, t) for t in page.trades] for i, page in enumerate(pages)]
+
+    # without `after` the page is the newest trades, merged from the back
+    if after is None and limit is not None:
+        merged = heapq.merge(*(reversed(k) for k in keyed), reverse=True)
+        trades = list(islice(merged, limit))[::-1]
+    else:
+        trades = list(islice(heapq.merge(*keyed), limit))
+
+    used = [0] * len(pages)
+    for _, i, _ in trades:
+        used[i] += 1
+
+    async def used_page(i: int) -> UserTrades:
+        if used[i] == len(pages[i].trades):
+            return pages[i]
+
+        return await fetch(i, used[i])
+
+    pages = await asyncio.gather(*(used_page(i) for i in range(len(pages))))
+
+    return UserTrades(
+        user_id=id,
+        trades=[t for _, _, t in trades],
+        after=CURSOR_SEP.join(p.after for p in pages),
+        before=CURSOR_SEP.join(p.before for p in pages),
+    )
+
+
+# every node holds the user's positions in the markets it owns
+@app.get("/users/{id}/portfolio")
+async def users_get_portfolio(id: Uuid) -> UserPortfolio:
+    parts = [
+        UserPortfolio.model_validate(p)
+        for p in await fan_out("GET", f"/users/{id}/portfolio")
+    ]
+
+    return UserPortfolio(
+        user_id=id,
+        cash=sum(p.cash for p in parts),
+        realized_pnl=sum(p.realized_pnl for p in parts),
+        positions=[pos for p in parts for pos in p.positions],
+    )
+
+
+# a user's P&L can be spread over several nodes, so every node's full standings
+# are needed before ranking
+@app.get("/leaderboard")
+async def get_leaderboard(
+    limit: int | None = Query(default=None, ge=0)
+) -> Leaderboard:
+    totals: dict[str, list[float]] = {}
+    for page in await fan_out("GET", "/leaderboard"):
+        for e in Leaderboard.model_validate(page).entries:
+            total = totals.setdefault(e.user_id, [0.0, 0.0])
+            total[0] += e.realized_pnl
+            total[1] += e.unrealized_pnl
+
+    ranked = heapq.nlargest(
+        len(totals) if limit is None else limit,
+        totals.items(),
+        key=lambda t: t[1][0] + t[1][1],
+    )
+
+    return Leaderboard(
+        entries=[
+            LeaderboardEntry(
+                rank=i + 1,
+                user_id=id,
+                pnl=realized + unrealized,
+                realized_pnl=realized,
+                unrealized_pnl=unrealized,
+            )
+            for i, (id, (realized, unrealized)) in enumerate(ranked)
+        ]
+    )
+
+
+markets = FastAPI()
+app.mount("/markets", markets, name="markets")
+
+
+# nodes list markets in creation order, so the pages are merged on created_at
+@markets.get("/")
+async def get_markets(
+    user_id: str | None = None,
+    offset: int = Query(default=0, ge=0),
+    limit: int | None = Query(default=None, ge=0),
+) -> MarketList:
+    params: dict[str, Any] = {} if user_id is None else {"user_id": user_id}
+    end = None if limit is None else offset + limit
+    if end is not None:
+        params["limit"] = end
+
+    lists = [
+        MarketList.model_validate(page).markets
+        for page in await fan_out("GET", "/markets/", params)
+    ]
+    merged = heapq.merge(*lists, key=lambda m: m.created_at)
+
+    return MarketList(markets=list(islice(merged, offset, end)))
+
+
+# ids are assigned here so the owner is known before the market exists
+@markets.post("/")
+async def create_market(info: MarketCreateInfo) -> Market:
+    if not info.id:
+        info.id = str(uuid.uuid4())
+
+    market = await call(RING.owner(info.id), "POST", "/markets/", info.model_dump())
+
+    return Market.model_validate(market)
+
+
+# a batch spanning several nodes is only atomic per node
+@markets.post("/bulk")
+async def create_markets(info: MarketBulkCreateInfo) -> MarketList:
+    for m in info.markets:
+        if not m.id:
+            m.id = str(uuid.uuid4())
+
+    groups = group_by_owner(info.markets, lambda m: m.id)
+    pages = await asyncio.gather(
+        *(
+            call(
+                node,
+                "POST",
+                "/markets/bulk",
+                MarketBulkCreateInfo(
+                    markets=[info.markets[i] for i in idxs], seed=info.seed
+                ).model_dump(),
+            )
+            for node, idxs in groups.items()
+        )
+    )
+
+    created: list[Market | None] = [None] * len(info.markets)
+    for idxs, page in zip(groups.values(), pages):
+        for i, m in zip(idxs, page["markets"]):
+            created[i] = Market.model_validate(m)
+
+    return MarketList(markets=created)
+
+
+@markets.post("/orders")
+async def markets_create_orders_many(
+    infos: list[MarketOrderCreateInfo],
+) -> list[OrderResult]:
+    groups = group_by_owner(infos, lambda i: i.market_id)
+    pages = await asyncio.gather(
+        *(
+            call(
+                node,
+                "POST",
+                "/markets/orders",
+                [infos[i].model_dump() for i in idxs],
+            )
+            for node, idxs in groups.items()
+        )
+    )
+
+    results: list[OrderResult | None] = [None] * len(infos)
+    for idxs, page in zip(groups.values(), pages):
+        for i, r in zip(idxs, page):
+            results[i] = OrderResult.model_validate(r)
+
+    return results
+
+
+# each node settles its markets in one step, but not in step with other nodes
+@markets.post("/resolve")
+async def markets_resolve_many(
+    infos: list[MarketResolveInfo],
+) -> list[MarketResolution]:
+    groups = group_by_owner(infos, lambda i: i.market_id)
+    pages = await asyncio.gather(
+        *(
+            call(
+                node,
+                "POST",
+                "/markets/resolve",
+                [infos[i].model_dump() for i in idxs],
+            )
+            for node, idxs in groups.items()
+        )
+    )
+
+    results: list[MarketResolution | None] = [None] * len(infos)
+    for idxs, page in zip(groups.values(), pages):
+        for i, r in zip(idxs, page):
+            results[i] = MarketResolution.model_validate(r)
+
+    return results
+
+
+# market event streams are relayed as they arrive, websockets need to go to the
+# owning node directly
+@markets.get("/{id}/events")
+async def markets_events(id: Uuid) -> Response:
+    request = CLIENT.build_request(
+        "GET", f"{RING.owner(id)}/markets/{id}/events", timeout=None
+    )
+    r = await CLIENT.send(request, stream=True)
+
+    if r.status_code != 200:
+        await r.aread()
+        await r.aclose()
+        return Response(content=r.content, status_code=r.status_code)
+
+    return StreamingResponse(
+        r.aiter_raw(),
+        media_type="text/event-stream",
+        background=BackgroundTask(r.aclose),
+    )
+
+
+# everything else about a single market is proxied to its owner as is
+@markets.api_route("/{id}", methods=["GET"])
+@markets.api_route("/{id}/{rest:path}", methods=["GET", "POST", "DELETE"])
+async def markets_forward(request: Request, id: Uuid, rest: str = "") -> Response:
+    path = f"/markets/{id}/{rest}" if rest else f"/markets/{id}"
+
+    r = await CLIENT.request(
+        request.method,
+        f"{RING.owner(id)}{path}",
+        params=request.query_params,
+        content=await request.body(),
+        headers={k: v for k, v in request.headers.items() if k in FORWARDED_HEADERS},
+    )
+
+    return Response(
+        content=r.content,
+        status_code=r.status_code,
+        headers={k: v for k, v in r.headers.items() if k in FORWARDED_HEADERS},
+    )
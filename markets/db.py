@@ -23,3 +23,28 @@ class Db[V: HasId]:
             raise KeyError("Exists")
 
         self.store[v.id] = v
+
+
+# maps external string ids to dense ints for the matching engine
+class Interner:
+    ids: list[str]
+    index: dict[str, int]
+
+    def __init__(self):
+        self.ids = []
+        self.index = {}
+
+    def __getitem__(self, idx: int) -> str:
+        return self.ids[idx]
+
+    def get(self, id: str) -> int | None:
+        return self.index.get(id)
+
+    def intern(self, id: str) -> int:
+        idx = self.index.get(id)
+        if idx is None:
+            idx = len(self.ids)
+            self.ids.append(id)
+            self.index[id] = idx
+
+        return idx
@@ -0,0 +1,519 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import multiprocessing
+import threading
+import zlib
+from array import array
+from itertools import islice
+from multiprocessing.connection import Connection
+from collections.abc import Callable
+from typing import Any
+
+import numpy as np
+
+from candles import Candle, Resolution
+from clob import Side
+from db import Db
+from events import print_fills
+from metrics import BookStats, MarketGauges
+from exchange import (
+    Book,
+    Exchange,
+    OrderInfo,
+    Placed,
+    Portfolio,
+    Settlement,
+    Top,
+    TradeSlice,
+    Update,
+    UserFill,
+)
+from snapshot import Snapshotter
+import snapshot
+
+type Listener = Callable[[list[Update]], None]
+
+
+# runs calls against an Exchange in this process
+class LocalShard:
+    exchange: Exchange
+    listener: Listener | None
+    # a dispatch of the exchange's events is queued on the loop
+    dispatching: bool
+
+    def __init__(self, exchange: Exchange):
+        self.exchange = exchange
+        self.listener = None
+        self.dispatching = False
+
+    def submit(self, method: str, *args: Any) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+
+        try:
+            fut.set_result(getattr(self.exchange, method)(*args))
+        except Exception as e:
+            fut.set_exception(e)
+
+        # subscribers run from the loop once the current callbacks are done,
+        # not inside the call
+        if not self.dispatching:
+            self.dispatching = True
+            loop.call_soon(self._dispatch)
+
+        return fut
+
+    def _dispatch(self):
+        self.dispatching = False
+        self.exchange.dispatch()
+
+        if self.exchange.updates:
+            updates, self.exchange.updates = self.exchange.updates, []
+            if self.listener:
+                self.listener(updates)
+
+    def close(self):
+        pass
+
+
+# calls a worker answers itself rather than passing to its Exchange: snapshots
+# of its books, taken when the call reaches it so they line up with everything
+# sent to the shard before
+class Worker:
+    exchange: Exchange
+    snapshotter: Snapshotter | None
+
+    def __init__(self, exchange: Exchange):
+        self.exchange = exchange
+        self.snapshotter = None
+
+    # waits for the last fork rather than skipping, so a round of shard
+    # snapshots is never partly written
+    def start_snapshot(self, path: str, journal_size: int):
+        if self.snapshotter is None:
+            self.snapshotter = Snapshotter(path)
+
+        self.snapshotter.wait()
+        self.snapshotter.start(Db(), self.exchange, journal_size)
+
+    def dump_snapshot(self, path: str, journal_size: int):
+        if self.snapshotter:
+            self.snapshotter.wait()
+
+        snapshot.dump(path, Db(), self.exchange, journal_size)
+
+    def load_snapshot(self, path: str) -> int:
+        return snapshot.load(path, Db(), self.exchange)
+
+
+def serve(conn: Connection, debug: bool = False):
+    exchange = Exchange()
+    if debug:
+        exchange.events.subscribe(print_fills)
+
+    worker = Worker(exchange)
+
+    while (calls := conn.recv()) is not None:
+        replies = []
+
+        for id, method, args in calls:
+            target = worker if hasattr(worker, method) else exchange
+            try:
+                replies.append((id, True, getattr(target, method)(*args)))
+            except Exception as e:
+                replies.append((id, False, e))
+
+        exchange.dispatch()
+        conn.send((replies, exchange.updates))
+        exchange.updates = []
+
+
+# a worker process owning the Exchange for its slice of the markets; calls made
+# in the same loop iteration go over the pipe as one message and are answered in
+# order, a reader thread hands the replies back to the event loop
+class ProcessShard:
+    process: multiprocessing.Process
+    conn: Connection
+    pending: dict[int, asyncio.Future]
+    outbox: list[tuple[int, str, tuple]]
+    next_id: int
+    loop: asyncio.AbstractEventLoop
+    listener: Listener | None
+    # set once the worker is gone; pending and later calls fail with it
+    error: ConnectionError | None
+
+    def __init__(self, index: int, debug: bool = False):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=serve,
+            args=(child, debug),
+            name=f"markets-shard-{index}",
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+
+        self.pending = {}
+        self.outbox = []
+        self.next_id = 0
+        self.loop = asyncio.get_running_loop()
+        self.listener = None
+        self.error = None
+
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def submit(self, method: str, *args: Any) -> asyncio.Future:
+        fut = self.loop.create_future()
+        if self.error:
+            fut.set_exception(self.error)
+            return fut
+
+        self.next_id += 1
+        self.pending[self.next_id] = fut
+
+        if not self.outbox:
+            self.loop.call_soon(self._flush)
+        self.outbox.append((self.next_id, method, args))
+
+        return fut
+
+    def _flush(self):
+        if self.error:
+            return
+
+        try:
+            self.conn.send(self.outbox)
+        except OSError:
+            self._fail()
+        self.outbox = []
+
+    def _read(self):
+        while True:
+            try:
+                replies, updates = self.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            self.loop.call_soon_threadsafe(self._resolve, replies, updates)
+
+        # the loop may already be closed if the shard was shut down with it
+        try:
+            self.loop.call_soon_threadsafe(self._fail)
+        except RuntimeError:
+            pass
+
+    def _fail(self):
+        if self.error:
+            return
+
+        self.error = ConnectionError(f"{self.process.name} exited")
+        self.outbox = []
+
+        pending, self.pending = self.pending, {}
+        for fut in pending.values():
+            if not fut.done():
+                fut.set_exception(self.error)
+
+    def _resolve(self, replies: list[tuple[int, bool, Any]], updates: list[Update]):
+        if updates and self.listener:
+            self.listener(updates)
+
+        for id, ok, value in replies:
+            fut = self.pending.pop(id)
+
+            if ok:
+                fut.set_result(value)
+            else:
+                fut.set_exception(value)
+
+    def close(self):
+        if not self.error:
+            if self.outbox:
+                self._flush()
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.process.join()
+        self.conn.close()
+
+
+type Shard = LocalShard | ProcessShard
+
+
+# routes each call to the shard owning the market (hash partitioned), and fans
+# user-level queries out to every shard, merging the answers
+class Engine:
+    shards: list[Shard]
+
+    def __init__(self, shards: list[Shard]):
+        self.shards = shards
+
+    @classmethod
+    def local(cls, exchange: Exchange) -> Engine:
+        return cls([LocalShard(exchange)])
+
+    # must be called from the event loop the engine will be used on
+    @classmethod
+    def processes(cls, n: int, debug: bool = False) -> Engine:
+        return cls([ProcessShard(i, debug) for i in range(n)])
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    # each worker process snapshots its own books to snapshot.shard_path(path, i),
+    # queued behind every call already sent so the shards agree with the journal
+    def start_snapshots(self, path: str, journal_size: int) -> asyncio.Future:
+        return self._each_shard("start_snapshot", path, journal_size)
+
+    def dump_snapshots(self, path: str, journal_size: int) -> asyncio.Future:
+        return self._each_shard("dump_snapshot", path, journal_size)
+
+    def load_snapshots(self, path: str) -> asyncio.Future[list[int]]:
+        return self._each_shard("load_snapshot", path)
+
+    def _each_shard(self, method: str, path: str, *args: Any) -> asyncio.Future:
+        return asyncio.gather(
+            *(
+                shard.submit(method, snapshot.shard_path(path, i), *args)
+                for i, shard in enumerate(self.shards)
+            )
+        )
+
+    # called with the changes to watched markets as the shards report them
+    def listen(self, listener: Listener):
+        for shard in self.shards:
+            shard.listener = listener
+
+    def _shard(self, market_id: str) -> Shard:
+        if len(self.shards) == 1:
+            return self.shards[0]
+
+        return self.shards[zlib.crc32(market_id.encode()) % len(self.shards)]
+
+    # seq is the market's position in the global listing
+    def create_market(self, id: str, seq: int) -> asyncio.Future[None]:
+        return self._shard(id).submit("create_market", id, seq)
+
+    def place(
+        self,
+        market_id: str,
+        user_id: str,
+        side: Side,
+        price: int,
+        quantity: int,
+        time: int | None = None,
+    ) -> asyncio.Future[Placed]:
+        return self._shard(market_id).submit(
+            "place", market_id, user_id, side, price, quantity, time
+        )
+
+    def place_many(
+        self, market_id: str, orders: list[tuple[str, Side, int, int, int | None]]
+    ) -> asyncio.Future[list[Placed]]:
+        return self._shard(market_id).submit("place_many", market_id, orders)
+
+    def cancel(self, market_id: str, order_id: int) -> asyncio.Future[OrderInfo | None]:
+        return self._shard(market_id).submit("cancel", market_id, order_id)
+
+    # each shard settles its markets in one call, so no order on them is matched
+    # part way through
+    async def resolve(self, resolutions: list[tuple[str, int]]) -> list[Settlement]:
+        groups: dict[Shard, list[int]] = {}
+        for i, (id, _) in enumerate(resolutions):
+            groups.setdefault(self._shard(id), []).append(i)
+
+        parts = await asyncio.gather(
+            *(
+                shard.submit("resolve", [resolutions[i] for i in idxs])
+                for shard, idxs in groups.items()
+            )
+        )
+
+        settled: list[Settlement | None] = [None] * len(resolutions)
+        for idxs, part in zip(groups.values(), parts):
+            for i, s in zip(idxs, part):
+                settled[i] = s
+
+        return settled
+
+    def seed(
+        self,
+        market_id: str,
+        time: array[int],
+        price: array[int],
+        quantity: array[int],
+    ) -> asyncio.Future[None]:
+        return self._shard(market_id).submit("seed", market_id, time, price, quantity)
+
+    def watch(self, market_id: str) -> asyncio.Future[None]:
+        return self._shard(market_id).submit("watch", market_id)
+
+    def unwatch(self, market_id: str) -> asyncio.Future[None]:
+        return self._shard(market_id).submit("unwatch", market_id)
+
+    def book(
+        self, market_id: str, seq: int | None = None, depth: int | None = None
+    ) -> asyncio.Future[Book | None]:
+        return self._shard(market_id).submit("book", market_id, seq, depth)
+
+    def top(self, market_id: str) -> asyncio.Future[Top]:
+        return self._shard(market_id).submit("top", market_id)
+
+    def candles(
+        self,
+        market_id: str,
+        resolution: Resolution,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> asyncio.Future[list[Candle]]:
+        return self._shard(market_id).submit(
+            "candles", market_id, resolution, start, end
+        )
+
+    def trades(
+        self,
+        market_id: str,
+        since: int | None = None,
+        until: int | None = None,
+        after: int | None = None,
+        before: int | None = None,
+        limit: int | None = None,
+    ) -> asyncio.Future[TradeSlice]:
+        return self._shard(market_id).submit(
+            "trades", market_id, since, until, after, before, limit
+        )
+
+    async def metrics(self) -> tuple[BookStats, list[MarketGauges]]:
+        parts = await asyncio.gather(*(s.submit("metrics") for s in self.shards))
+
+        stats = BookStats()
+        markets = []
+        for shard_stats, shard_markets in parts:
+            stats.merge(shard_stats)
+            markets += shard_markets
+
+        return stats, markets
+
+    async def portfolio(self, user_id: str) -> Portfolio:
+        parts = await asyncio.gather(
+            *(s.submit("portfolio", user_id) for s in self.shards)
+        )
+
+        return Portfolio(
+            sum(p.cash for p in parts), [h for p in parts for h in p.holdings]
+        )
+
+    # (user id, realized, unrealized) of the users who have traded, ranked by
+    # total P&L, best first; a user trading on several shards has their P&L
+    # summed before ranking
+    async def leaderboard(
+        self, limit: int | None = None
+    ) -> list[tuple[str, float, float]]:
+        parts = await asyncio.gather(*(s.submit("standings") for s in self.shards))
+
+        if len(parts) == 1:
+            ids, realized, unrealized, positions = parts[0]
+            traded = np.flatnonzero(positions)
+            realized = realized[traded]
+            unrealized = unrealized[traded]
+        else:
+            traders = [np.flatnonzero(p.positions) for p in parts]
+            ids, users = np.unique(
+                [p.user_ids[u] for p, t in zip(parts, traders) for u in t.tolist()],
+                return_inverse=True,
+            )
+            ids = ids.tolist()
+            traded = np.arange(len(ids))
+            realized = np.bincount(
+                users, np.concatenate([p.realized[t] for p, t in zip(parts, traders)])
+            )
+            unrealized = np.bincount(
+                users, np.concatenate([p.unrealized[t] for p, t in zip(parts, traders)])
+            )
+
+        pnl = realized + unrealized
+        if limit is not None and limit < len(pnl):
+            top = np.argpartition(-pnl, limit)[:limit]
+            top = top[np.argsort(-pnl[top], kind="stable")]
+        else:
+            top = np.argsort(-pnl, kind="stable")
+
+        return [
+            (ids[traded[i]], float(realized[i]), float(unrealized[i]))
+            for i in top.tolist()
+        ]
+
+    async def user_market_ids(
+        self, user_id: str, offset: int = 0, limit: int | None = None
+    ) -> list[str]:
+        end = None if limit is None else offset + limit
+        parts = await asyncio.gather(
+            *(s.submit("user_market_ids", user_id, end) for s in self.shards)
+        )
+
+        return [id for _, id in islice(heapq.merge(*parts), offset, end)]
+
+    def _positions(self, cursor: str | None) -> list[int | None]:
+        if not cursor:
+            return [None] * len(self.shards)
+
+        positions = [int(p) for p in cursor.split(".")]
+        if len(positions) != len(self.shards):
+            raise ValueError("cursor does not match the shard count")
+        if any(p < 0 for p in positions):
+            raise ValueError("cursor positions must not be negative")
+
+        return positions
+
+    # cursors hold one fill index position per shard, joined with "."; each
+    # shard's page is k-way merged on time and the cursors returned bound what
+    # was taken from every shard, as (after, before) of the page's (stop, start)
+    async def user_trades(
+        self,
+        user_id: str,
+        since: int | None = None,
+        after: str | None = None,
+        before: str | None = None,
+        limit: int | None = None,
+    ) -> tuple[list[UserFill], str, str]:
+        afters = self._positions(after)
+        befores = self._positions(before)
+
+        parts = await asyncio.gather(
+            *(
+                s.submit("user_trades", user_id, since, a, b, limit)
+                for s, a, b in zip(self.shards, afters, befores)
+            )
+        )
+
+        pages = [
+            [(f.time, i, f) for f in fills] for i, (fills, _, _) in enumerate(parts)
+        ]
+        taken = [0] * len(parts)
+
+        # without `after` the page is the newest fills, merged from the back
+        tail = after is None and limit is not None
+        if tail:
+            merged = heapq.merge(*(reversed(p) for p in pages), reverse=True)
+            fills = list(islice(merged, limit))[::-1]
+        else:
+            fills = list(islice(heapq.merge(*pages), limit))
+
+        for _, i, _ in fills:
+            taken[i] += 1
+
+        if tail:
+            bounds = [(stop - n, stop) for (_, _, stop), n in zip(parts, taken)]
+        else:
+            bounds = [(start, start + n) for (_, start, _), n in zip(parts, taken)]
+
+        return (
+            [f for _, _, f in fills],
+            ".".join(str(stop) for _, stop in bounds),
+            ".".join(str(start) for start, _ in bounds),
+        )
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from clob import Side
+
+
+# what a book emits; users are interned indices and `seq` is the book's seq
+# after the change, every change ending with a BookChanged
+
+
+class Accepted(NamedTuple):
+    market: str
+    seq: int
+    order: int
+    user: int
+    side: Side
+    price: int
+    # left resting after matching
+    remaining: int
+    time: int
+
+
+class Fill(NamedTuple):
+    market: str
+    seq: int
+    time: int
+    price: int
+    quantity: int
+    buyer: int
+    seller: int
+
+
+class Cancelled(NamedTuple):
+    market: str
+    seq: int
+    order: int
+    side: Side
+    price: int
+    quantity: int
+
+
+# new total resting at a price, 0 once the level is empty
+class LevelChanged(NamedTuple):
+    market: str
+    seq: int
+    side: Side
+    price: int
+    quantity: int
+
+
+class BookChanged(NamedTuple):
+    market: str
+    seq: int
+    midpoint: float | None
+
+
+# the market settled at `price`, its `cancelled` resting orders dropped at once
+# (their levels are reported emptied rather than each order cancelled)
+class Resolved(NamedTuple):
+    market: str
+    seq: int
+    price: int
+    cancelled: int
+
+
+type Event = Accepted | Fill | Cancelled | LevelChanged | BookChanged | Resolved
+type Subscriber = Callable[[list[Event]], None]
+
+
+# fixed size ring of events with a single writer; each subscriber has its own
+# read position and is handed everything it hasn't seen when the ring is
+# dispatched. Dispatch happens off the order path, or from push when the
+# slowest subscriber is a whole ring behind, so nothing is ever overwritten
+class EventRing:
+    slots: list[Event | None]
+    # events ever pushed
+    head: int
+    subscribers: list[Subscriber]
+    positions: list[int]
+
+    def __init__(self, capacity: int = 1 << 16):
+        self.slots = [None] * capacity
+        self.head = 0
+        self.subscribers = []
+        self.positions = []
+
+    # events not yet handed to every subscriber
+    def backlog(self) -> int:
+        return self.head - min(self.positions, default=self.head)
+
+    def subscribe(self, subscriber: Subscriber):
+        self.subscribers.append(subscriber)
+        self.positions.append(self.head)
+
+    # the subscriber still gets what was pushed before
+    def unsubscribe(self, subscriber: Subscriber):
+        self.dispatch()
+
+        i = self.subscribers.index(subscriber)
+        del self.subscribers[i]
+        del self.positions[i]
+
+    # books skip building events while nobody is subscribed
+    @property
+    def active(self) -> bool:
+        return bool(self.subscribers)
+
+    def push(self, event: Event):
+        if self.backlog() == len(self.slots):
+            self.dispatch()
+
+        self.slots[self.head % len(self.slots)] = event
+        self.head += 1
+
+    def _read(self, start: int) -> list[Event]:
+        n = len(self.slots)
+        lo = start % n
+        hi = lo + self.head - start
+
+        if hi <= n:
+            return self.slots[lo:hi]
+
+        return self.slots[lo:] + self.slots[: hi - n]
+
+    def dispatch(self):
+        for i, subscriber in enumerate(self.subscribers):
+            start = self.positions[i]
+            if start == self.head:
+                continue
+
+            self.positions[i] = self.head
+            subscriber(self._read(start))
+
+
+# debug subscriber printing every fill
+def print_fills(events: list[Event]):
+    order = None
+
+    for e in events:
+        match e:
+            case Accepted():
+                order = e
+            case Fill() if order and (order.market, order.seq) == (e.market, e.seq):
+                print(
+                    f"Order {order.order} ({order.side}): filled {e.quantity}"
+                    f" @ {e.price} (limit={order.price})"
+                )
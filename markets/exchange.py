@@ -0,0 +1,548 @@
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left, insort
+from itertools import islice
+from typing import NamedTuple
+
+import numpy as np
+
+from candles import Candle, Resolution
+from clob import Clob, LimitOrder, Side, check_price
+from events import BookChanged, Event, EventRing, Fill, LevelChanged
+from db import Db, Interner
+from ledger import Ledger
+from metrics import BookStats, MarketGauges
+
+
+# a user's fills across all markets, in fill order, as references into the
+# market trade tapes
+class UserFills:
+    markets: array[int]
+    rows: array[int]
+
+    def __init__(self):
+        self.markets = array("i")
+        self.rows = array("q")
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def append(self, market: int, row: int):
+        self.markets.append(market)
+        self.rows.append(row)
+
+
+# plain results of the string-keyed API below, cheap to pickle between shards
+
+
+class OrderInfo(NamedTuple):
+    id: int
+    user_id: str
+    side: Side
+    price: int
+    # remaining
+    quantity: int
+    time: int
+
+
+class Placed(NamedTuple):
+    order: OrderInfo
+    # (price, quantity)
+    fills: list[tuple[int, int]]
+
+
+class Book(NamedTuple):
+    seq: int
+    midpoint: float | None
+    # (price, total quantity), best level first
+    bids: list[tuple[int, int]]
+    asks: list[tuple[int, int]]
+
+
+# best level on each side as (price, total quantity)
+class Top(NamedTuple):
+    seq: int
+    midpoint: float | None
+    bid: tuple[int, int] | None
+    ask: tuple[int, int] | None
+
+
+class TradeSlice(NamedTuple):
+    midpoint: float | None
+    # tape rows [start, stop)
+    start: int
+    stop: int
+    time: array[int]
+    price: array[int]
+    quantity: array[int]
+
+
+# a change to a watched market, levels carry their new total (0 once emptied)
+class Update(NamedTuple):
+    market_id: str
+    seq: int
+    midpoint: float | None
+    bids: list[tuple[int, int]]
+    asks: list[tuple[int, int]]
+    # (time, price, quantity)
+    trades: list[tuple[int, int, int]]
+
+
+class Holding(NamedTuple):
+    market_id: str
+    # signed, positive when long
+    quantity: int
+    # None while flat
+    entry: float | None
+    realized: float
+
+
+class Portfolio(NamedTuple):
+    cash: int
+    holdings: list[Holding]
+
+
+class Settlement(NamedTuple):
+    market_id: str
+    price: int
+    # resting orders dropped
+    cancelled: int
+    # open positions paid out
+    positions: int
+
+
+# by user idx
+class Standings(NamedTuple):
+    user_ids: list[str]
+    realized: np.ndarray
+    unrealized: np.ndarray
+    # users without any are left out of rankings
+    positions: np.ndarray
+
+
+class UserFill(NamedTuple):
+    time: int
+    market_id: str
+    side: Side
+    price: int
+    quantity: int
+
+
+def check_cursors(after: int | None, before: int | None):
+    if (after is not None and after < 0) or (before is not None and before < 0):
+        raise ValueError("cursor positions must not be negative")
+    if after is not None and before is not None and after > before:
+        raise ValueError("after must not be past before")
+
+
+# cuts [start, stop) down to `limit` rows, keeping the newest ones for a `tail`
+# page and the oldest otherwise; a start past the stop gives an empty page there,
+# so the after cursor handed back never goes below the one sent
+def page(start: int, stop: int, tail: bool, limit: int | None) -> tuple[int, int]:
+    stop = max(start, stop)
+
+    if limit is None:
+        return start, stop
+    if tail:
+        return max(start, stop - limit), stop
+
+    return start, min(stop, start + limit)
+
+
+# the matching engine: every book plus the cross-market indices kept at fill time
+class Exchange:
+    clobs: Db[Clob]
+    # market idx <-> market id, books[idx] is the clob
+    market_ids: Interner
+    books: list[Clob]
+    # by market idx, position in the global market listing
+    market_seq: array[int]
+
+    user_ids: Interner
+    # by user idx
+    user_fills: list[UserFills]
+    # by user idx, the market idxs the user has placed orders on, ascending
+    user_markets: list[list[int]]
+    ledger: Ledger
+
+    # market id -> number of streams following it
+    watchers: dict[str, int]
+    # changes to watched markets, collected by the engine after each call
+    updates: list[Update]
+    # the update being assembled from a change's events
+    pending: Update | None
+
+    events: EventRing
+    stats: BookStats
+
+    def __init__(self):
+        self.clobs = Db()
+        self.market_ids = Interner()
+        self.books = []
+        self.market_seq = array("q")
+        self.user_ids = Interner()
+        self.user_fills = []
+        self.user_markets = []
+        self.ledger = Ledger()
+        self.watchers = {}
+        self.updates = []
+        self.pending = None
+        self.events = EventRing()
+        self.stats = BookStats()
+
+    def add_clob(self, id: str, seq: int | None = None) -> Clob:
+        clob = Clob(id=id, events=self.events, stats=self.stats)
+
+        self.clobs.insert(clob)
+        self.market_seq.append(len(self.books) if seq is None else seq)
+        self.market_ids.intern(id)
+        self.books.append(clob)
+
+        return clob
+
+    def user(self, id: str) -> int:
+        user = self.user_ids.intern(id)
+
+        while len(self.user_fills) <= user:
+            self.user_fills.append(UserFills())
+            self.user_markets.append([])
+            self.ledger.add_user()
+
+        return user
+
+    def insert_order(self, clob: Clob, order: LimitOrder) -> range:
+        market = self.market_ids.index[clob.id]
+        joined = order.user not in clob.users
+
+        fills = clob.insert_order(order)
+
+        if joined:
+            insort(self.user_markets[order.user], market)
+
+        if not fills:
+            return fills
+
+        tape = clob.trades
+        for row in fills:
+            buyer = tape.buyer[row]
+            seller = tape.seller[row]
+
+            self.user_fills[buyer].append(market, row)
+            if seller != buyer:
+                self.user_fills[seller].append(market, row)
+                self._settle(market, buyer, seller, tape.price[row], tape.quantity[row])
+
+        return fills
+
+    def _settle(self, market: int, buyer: int, seller: int, price: int, quantity: int):
+        self.ledger.fill(buyer, market, quantity, price)
+        self.ledger.fill(seller, market, -quantity, price)
+
+    # string-keyed API used by engine.Engine, in process or inside a shard worker
+
+    def create_market(self, id: str, seq: int | None = None):
+        self.add_clob(id, seq)
+
+    def place(
+        self,
+        market_id: str,
+        user_id: str,
+        side: Side,
+        price: int,
+        quantity: int,
+        time: int | None = None,
+    ) -> Placed:
+        clob = self.clobs[market_id]
+        order = clob.new_order(self.user(user_id), side, price, quantity, time)
+
+        fills = self.insert_order(clob, order)
+
+        tape = clob.trades
+        return Placed(
+            OrderInfo(order.id, user_id, side, price, order.quantity, order.time),
+            [(tape.price[i], tape.quantity[i]) for i in fills],
+        )
+
+    def place_many(
+        self, market_id: str, orders: list[tuple[str, Side, int, int, int | None]]
+    ) -> list[Placed]:
+        return [self.place(market_id, *o) for o in orders]
+
+    def cancel(self, market_id: str, order_id: int) -> OrderInfo | None:
+        clob = self.clobs[market_id]
+        order = clob.delete_order(order_id)
+        if not order:
+            return None
+
+        return OrderInfo(
+            order.id,
+            self.user_ids[order.user],
+            order.side,
+            order.price,
+            order.quantity,
+            order.time,
+        )
+
+    # settles each (market id, price) given as one step: books are cleared and
+    # every position paid out at the price. Nothing changes if any market is
+    # unknown or already resolved
+    def resolve(self, resolutions: list[tuple[str, int]]) -> list[Settlement]:
+        clobs = [self.clobs[id] for id, _ in resolutions]
+
+        if len({clob.id for clob in clobs}) != len(clobs):
+            raise ValueError("a market is resolved more than once")
+        for clob, (_, price) in zip(clobs, resolutions):
+            check_price(price)
+            if clob.settled is not None:
+                raise ValueError(f"market {clob.id} is already resolved")
+
+        prices = [price for _, price in resolutions]
+        cancelled = [clob.resolve(price) for clob, price in zip(clobs, prices)]
+        positions = self.ledger.settle(
+            np.array([self.market_ids.index[clob.id] for clob in clobs]),
+            np.array(prices, dtype=np.int64),
+        )
+
+        return [
+            Settlement(id, price, n, int(held))
+            for (id, price), n, held in zip(resolutions, cancelled, positions)
+        ]
+
+    def seed(
+        self,
+        market_id: str,
+        time: array[int],
+        price: array[int],
+        quantity: array[int],
+    ):
+        self.clobs[market_id].seed(time, price, quantity)
+
+    # streams are fed from the book events, only collected while one is open
+    def watch(self, market_id: str):
+        if not self.watchers:
+            self.events.subscribe(self._collect)
+
+        self.watchers[market_id] = self.watchers.get(market_id, 0) + 1
+
+    def unwatch(self, market_id: str):
+        if self.watchers[market_id] == 1:
+            del self.watchers[market_id]
+        else:
+            self.watchers[market_id] -= 1
+
+        if not self.watchers:
+            self.events.unsubscribe(self._collect)
+            self.pending = None
+
+    # hands queued events to their subscribers, called by the engine between calls
+    def dispatch(self):
+        self.events.dispatch()
+
+    # event subscriber turning each change to a watched market into an Update
+    def _collect(self, events: list[Event]):
+        watchers = self.watchers
+
+        for e in events:
+            if e.market not in watchers:
+                continue
+
+            update = self.pending
+            if update is None or (update.market_id, update.seq) != (e.market, e.seq):
+                update = self.pending = Update(e.market, e.seq, None, [], [], [])
+
+            match e:
+                case Fill():
+                    update.trades.append((e.time, e.price, e.quantity))
+                case LevelChanged(side="bid"):
+                    update.bids.append((e.price, e.quantity))
+                case LevelChanged(side="ask"):
+                    update.asks.append((e.price, e.quantity))
+                case BookChanged():
+                    self.updates.append(update._replace(midpoint=e.midpoint))
+                    self.pending = None
+
+    # None if the book is still at `seq`, so callers can keep what they built;
+    # `depth` stops each side after that many levels
+    def book(
+        self, market_id: str, seq: int | None = None, depth: int | None = None
+    ) -> Book | None:
+        clob = self.clobs[market_id]
+        if clob.seq == seq:
+            return None
+
+        return Book(
+            clob.seq,
+            clob.midpoint(),
+            [(bid.price, bid.quantity) for bid in islice(clob.bids, depth)],
+            [(ask.price, ask.quantity) for ask in islice(clob.asks, depth)],
+        )
+
+    def top(self, market_id: str) -> Top:
+        clob = self.clobs[market_id]
+        bid = clob.bids.first
+        ask = clob.asks.first
+
+        return Top(
+            clob.seq,
+            clob.midpoint(),
+            (bid.price, bid.quantity) if bid else None,
+            (ask.price, ask.quantity) if ask else None,
+        )
+
+    def candles(
+        self,
+        market_id: str,
+        resolution: Resolution,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> list[Candle]:
+        return self.clobs[market_id].trades.candles.get(resolution, start, end)
+
+    def trades(
+        self,
+        market_id: str,
+        since: int | None = None,
+        until: int | None = None,
+        after: int | None = None,
+        before: int | None = None,
+        limit: int | None = None,
+    ) -> TradeSlice:
+        check_cursors(after, before)
+
+        clob = self.clobs[market_id]
+        tape = clob.trades
+
+        rows = tape.between(since, until)
+        start, stop = page(
+            max(rows.start, after or 0),
+            rows.stop if before is None else min(rows.stop, before),
+            after is None,
+            limit,
+        )
+
+        return TradeSlice(
+            clob.midpoint(),
+            start,
+            stop,
+            tape.time[start:stop],
+            tape.price[start:stop],
+            tape.quantity[start:stop],
+        )
+
+    # counters so far plus a reading of every book, taken when metrics are scraped
+    def metrics(self) -> tuple[BookStats, list[MarketGauges]]:
+        return self.stats, [
+            MarketGauges(
+                clob.id,
+                clob.bids.depth,
+                clob.asks.depth,
+                len(clob.orders),
+                len(clob.trades),
+            )
+            for clob in self.books
+        ]
+
+    # cash and a holding per market traded, without going through the fills;
+    # ordered by market
+    def portfolio(self, user_id: str) -> Portfolio:
+        user = self.user_ids.get(user_id)
+        if user is None:
+            return Portfolio(0, [])
+
+        ledger = self.ledger
+        return Portfolio(
+            ledger.cash[user],
+            [
+                Holding(
+                    self.books[m].id,
+                    ledger.quantity[row],
+                    ledger.entry(row),
+                    ledger.realized[row],
+                )
+                for m, row in sorted(ledger.rows[user].items())
+            ],
+        )
+
+    # what open positions are marked at: the midpoint, else the last trade, else
+    # nan for a market that has never had both
+    def marks(self) -> np.ndarray:
+        marks = np.full(len(self.books), np.nan)
+
+        for i, clob in enumerate(self.books):
+            mark = clob.midpoint()
+            if mark is None and len(clob.trades):
+                mark = clob.trades.price[-1]
+            if mark is not None:
+                marks[i] = mark
+
+        return marks
+
+    # P&L of every user, marked to market in one pass
+    def standings(self) -> Standings:
+        realized, unrealized, positions = self.ledger.value(self.marks())
+
+        return Standings(self.user_ids.ids, realized, unrealized, positions)
+
+    # (seq, market id) of the first `limit` markets the user has placed orders on
+    def user_market_ids(
+        self, user_id: str, limit: int | None = None
+    ) -> list[tuple[int, str]]:
+        user = self.user_ids.get(user_id)
+        if user is None:
+            return []
+
+        return [
+            (self.market_seq[m], self.books[m].id)
+            for m in self.user_markets[user][:limit]
+        ]
+
+    # a user's fills at positions [after, before) of their fill index, skipping
+    # fills before `since`, plus the positions [start, stop) returned
+    def user_trades(
+        self,
+        user_id: str,
+        since: int | None = None,
+        after: int | None = None,
+        before: int | None = None,
+        limit: int | None = None,
+    ) -> tuple[list[UserFill], int, int]:
+        check_cursors(after, before)
+
+        user = self.user_ids.get(user_id)
+        if user is None:
+            return [], 0, 0
+
+        fills = self.user_fills[user]
+        books = self.books
+
+        start = after or 0
+        if since is not None:
+            start = max(
+                start,
+                bisect_left(
+                    range(len(fills)),
+                    since,
+                    key=lambda i: books[fills.markets[i]].trades.time[fills.rows[i]],
+                ),
+            )
+
+        stop = len(fills) if before is None else min(len(fills), before)
+        start, stop = page(start, stop, after is None, limit)
+
+        out = []
+        for i in range(start, stop):
+            clob = books[fills.markets[i]]
+            tape = clob.trades
+            row = fills.rows[i]
+            out.append(
+                UserFill(
+                    tape.time[row],
+                    clob.id,
+                    "bid" if tape.buyer[row] == user else "ask",
+                    tape.price[row],
+                    tape.quantity[row],
+                )
+            )
+
+        return out, start, stop
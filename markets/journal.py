@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import os
+import struct
+import threading
+import zlib
+from array import array
+from collections.abc import Iterator
+
+from clob import Side
+
+# record: <payload length, crc32 of payload> payload
+# payload: kind byte, fixed fields, length-prefixed utf-8 strings
+HEADER = struct.Struct("<II")
+STR_LEN = struct.Struct("<I")
+
+MARKET = 1
+ORDER = 2
+CANCEL = 3
+SEED = 4
+RESOLVE = 5
+
+MARKET_FIELDS = struct.Struct("<Bq")  # kind, created_at ns
+ORDER_FIELDS = struct.Struct("<BqBBq")  # kind, time ns, side, price, quantity
+CANCEL_FIELDS = struct.Struct("<Bq")  # kind, order id
+SEED_FIELDS = struct.Struct("<BI")  # kind, trade count, then time/price/qty columns
+RESOLVE_FIELDS = struct.Struct("<Bb")  # kind, settlement price
+
+SIDES: list[Side] = ["bid", "ask"]
+
+type Event = (
+    tuple[int, str, str, str, int]
+    | tuple[int, str, str, Side, int, int, int]
+    | tuple[int, str, int]
+    | tuple[int, str, array[int], array[int], array[int]]
+    | tuple[int, str, int]
+)
+
+
+def _str(s: str) -> bytes:
+    b = s.encode()
+    return STR_LEN.pack(len(b)) + b
+
+
+def _record(payload: bytes) -> bytes:
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def encode_market(id: str, name: str, description: str, created_at: int) -> bytes:
+    return _record(
+        MARKET_FIELDS.pack(MARKET, created_at)
+        + _str(id)
+        + _str(name)
+        + _str(description)
+    )
+
+
+def encode_order(
+    market_id: str, user_id: str, side: Side, price: int, quantity: int, time: int
+) -> bytes:
+    return _record(
+        ORDER_FIELDS.pack(ORDER, time, SIDES.index(side), price, quantity)
+        + _str(market_id)
+        + _str(user_id)
+    )
+
+
+def encode_cancel(market_id: str, order_id: int) -> bytes:
+    return _record(CANCEL_FIELDS.pack(CANCEL, order_id) + _str(market_id))
+
+
+def encode_seed(
+    market_id: str, time: array[int], price: array[int], quantity: array[int]
+) -> bytes:
+    return _record(
+        SEED_FIELDS.pack(SEED, len(time))
+        + time.tobytes()
+        + price.tobytes()
+        + quantity.tobytes()
+        + _str(market_id)
+    )
+
+
+def encode_resolve(market_id: str, price: int) -> bytes:
+    return _record(RESOLVE_FIELDS.pack(RESOLVE, price) + _str(market_id))
+
+
+def _strs(payload: bytes, offset: int, n: int) -> list[str]:
+    out = []
+    for _ in range(n):
+        (size,) = STR_LEN.unpack_from(payload, offset)
+        offset += STR_LEN.size
+        out.append(payload[offset : offset + size].decode())
+        offset += size
+
+    return out
+
+
+def decode(payload: bytes) -> Event:
+    kind = payload[0]
+
+    if kind == MARKET:
+        _, created_at = MARKET_FIELDS.unpack_from(payload)
+        id, name, description = _strs(payload, MARKET_FIELDS.size, 3)
+        return (MARKET, id, name, description, created_at)
+
+    if kind == ORDER:
+        _, time, side, price, quantity = ORDER_FIELDS.unpack_from(payload)
+        market_id, user_id = _strs(payload, ORDER_FIELDS.size, 2)
+        return (ORDER, market_id, user_id, SIDES[side], price, quantity, time)
+
+    if kind == CANCEL:
+        _, order_id = CANCEL_FIELDS.unpack_from(payload)
+        (market_id,) = _strs(payload, CANCEL_FIELDS.size, 1)
+        return (CANCEL, market_id, order_id)
+
+    if kind == SEED:
+        _, n = SEED_FIELDS.unpack_from(payload)
+        offset = SEED_FIELDS.size
+        columns = []
+        for typecode in ("q", "b", "q"):
+            column = array(typecode)
+            column.frombytes(payload[offset : offset + n * column.itemsize])
+            offset += n * column.itemsize
+            columns.append(column)
+
+        (market_id,) = _strs(payload, offset, 1)
+        return (SEED, market_id, *columns)
+
+    if kind == RESOLVE:
+        _, price = RESOLVE_FIELDS.unpack_from(payload)
+        (market_id,) = _strs(payload, RESOLVE_FIELDS.size, 1)
+        return (RESOLVE, market_id, price)
+
+    raise ValueError(f"unknown journal record kind {kind}")
+
+
+# events from byte `offset` on, e.g. the journal size recorded in a snapshot
+def replay(path: str, offset: int = 0) -> Iterator[Event]:
+    if not os.path.exists(path):
+        return
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+
+    pos = 0
+    while pos + HEADER.size <= len(data):
+        size, crc = HEADER.unpack_from(data, pos)
+        start = pos + HEADER.size
+        payload = data[start : start + size]
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            break
+
+        yield decode(payload)
+        pos = start + size
+
+    # drop a torn tail left by a crash mid-write so new records follow good ones
+    if pos < len(data):
+        with open(path, "r+b") as f:
+            f.truncate(offset + pos)
+
+
+# append-only event log; appends only queue the record and a writer thread
+# writes and fsyncs whole batches (group commit), so records acknowledged
+# within the last fsync_interval may be lost on a crash
+class Journal:
+    path: str
+    fsync: bool
+    fsync_interval: float
+    batch: int
+
+    def __init__(
+        self,
+        path: str,
+        fsync: bool = True,
+        fsync_interval: float = 0.005,
+        batch: int = 4096,
+    ):
+        self.path = path
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.batch = batch
+
+        self._file = open(path, "ab")
+        self._size = self._file.tell()
+        self._pending: list[bytes] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # bytes written so far, once everything pending is flushed
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def append(self, record: bytes):
+        with self._lock:
+            self._pending.append(record)
+            self._size += len(record)
+            full = len(self._pending) >= self.batch
+
+        if full:
+            self._wake.set()
+
+    # write out and fsync everything appended so far before returning
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+
+            if not pending:
+                return
+
+            self._file.write(b"".join(pending))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.fsync_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+
+        self.flush()
+        self._file.close()
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+from array import array
+
+import numpy as np
+
+
+# every user's cash and their position in each market they have traded, updated
+# as orders fill. Positions are rows of flat columns (a sparse users x markets
+# matrix) so they can be valued in bulk without copying them out
+class Ledger:
+    # by user idx, received for asks filled less paid for bids filled
+    cash: array[int]
+    # by user idx, market idx -> position row
+    rows: list[dict[int, int]]
+
+    # position rows
+    user: array[int]
+    market: array[int]
+    # signed, positive when long
+    quantity: array[int]
+    # what the open quantity was entered at, in total and signed like quantity
+    cost: array[float]
+    # from the parts of the position closed out so far
+    realized: array[float]
+
+    def __init__(self):
+        self.cash = array("q")
+        self.rows = []
+        self.user = array("i")
+        self.market = array("i")
+        self.quantity = array("q")
+        self.cost = array("d")
+        self.realized = array("d")
+
+    # rebuilds the row index after the columns were loaded wholesale
+    def reindex(self):
+        self.rows = [{} for _ in self.cash]
+        for row, (user, market) in enumerate(zip(self.user, self.market)):
+            self.rows[user][market] = row
+
+    def add_user(self):
+        self.cash.append(0)
+        self.rows.append({})
+
+    def _row(self, user: int, market: int) -> int:
+        rows = self.rows[user]
+
+        row = rows.get(market)
+        if row is None:
+            row = rows[market] = len(self.user)
+            self.user.append(user)
+            self.market.append(market)
+            self.quantity.append(0)
+            self.cost.append(0.0)
+            self.realized.append(0.0)
+
+        return row
+
+    # quantity is signed like the position, positive for a buy
+    def fill(self, user: int, market: int, quantity: int, price: int):
+        self.cash[user] -= quantity * price
+
+        row = self._row(user, market)
+        held = self.quantity[row]
+        now = self.quantity[row] = held + quantity
+
+        if held == 0 or (held > 0) == (quantity > 0):
+            self.cost[row] += quantity * price
+            return
+
+        # reducing: the closed part realizes against the average entry price,
+        # anything past flat opens a new position at this price
+        closed = min(abs(held), abs(quantity)) * (1 if held > 0 else -1)
+        entry = self.cost[row] / held
+        self.realized[row] += (price - entry) * closed
+
+        if now == 0 or (now > 0) != (held > 0):
+            self.cost[row] = now * price
+        else:
+            self.cost[row] -= entry * closed
+
+    # average price the open quantity was entered at, None while flat
+    def entry(self, row: int) -> float | None:
+        quantity = self.quantity[row]
+
+        return self.cost[row] / quantity if quantity else None
+
+    # per user (realized, unrealized) P&L and number of positions, marking every
+    # open position at `marks[market]` in one pass; positions in markets without
+    # a mark (nan) are carried at cost
+    def value(self, marks: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        users = len(self.cash)
+        user = np.frombuffer(self.user, dtype=np.int32)
+        market = np.frombuffer(self.market, dtype=np.int32)
+        quantity = np.frombuffer(self.quantity, dtype=np.int64)
+        cost = np.frombuffer(self.cost, dtype=np.float64)
+        realized = np.frombuffer(self.realized, dtype=np.float64)
+
+        unrealized = quantity * marks[market] - cost
+        np.nan_to_num(unrealized, copy=False, nan=0.0)
+
+        return (
+            np.bincount(user, weights=realized, minlength=users),
+            np.bincount(user, weights=unrealized, minlength=users),
+            np.bincount(user, minlength=users),
+        )
+
+    # closes every position in `markets` at its settlement price in one pass,
+    # paying the holders; returns the open positions settled per market
+    def settle(self, markets: np.ndarray, prices: np.ndarray) -> np.ndarray:
+        order = np.argsort(markets)
+        markets = markets[order]
+
+        market = np.frombuffer(self.market, dtype=np.int32)
+        rows = np.flatnonzero(np.isin(market, markets))
+        which = order[np.searchsorted(markets, market[rows])]
+
+        user = np.frombuffer(self.user, dtype=np.int32)[rows]
+        cash = np.frombuffer(self.cash, dtype=np.int64)
+        quantity = np.frombuffer(self.quantity, dtype=np.int64)
+        cost = np.frombuffer(self.cost, dtype=np.float64)
+        realized = np.frombuffer(self.realized, dtype=np.float64)
+
+        held = quantity[rows]
+        payout = held * prices[which]
+
+        np.add.at(cash, user, payout)
+        realized[rows] += payout - cost[rows]
+        quantity[rows] = 0
+        cost[rows] = 0.0
+
+        return np.bincount(which[held != 0], minlength=len(markets))
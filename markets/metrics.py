@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+from collections.abc import Iterator
+from itertools import accumulate
+from typing import NamedTuple
+
+
+# exponents of the power of two bucket bounds (in ns) exposed for each histogram,
+# from ~65us to ~1s for requests and ~0.5us to ~8ms for matching
+REQUEST_BUCKETS = range(16, 31, 2)
+MATCHING_BUCKETS = range(9, 25, 2)
+
+
+# power of two buckets, so recording is a bit_length and an increment; counts
+# are per bucket and only made cumulative when rendered
+class Histogram:
+    __slots__ = ("counts", "sum")
+
+    # counts[b] is observations in (2 ** (b - 1), 2 ** b]
+    counts: list[int]
+    sum: int
+
+    def __init__(self):
+        self.counts = [0] * 65
+        self.sum = 0
+
+    def observe(self, ns: int):
+        self.counts[(ns - 1).bit_length()] += 1
+        self.sum += ns
+
+    def merge(self, other: Histogram):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.sum += other.sum
+
+
+# what the books of one exchange record as they match
+class BookStats:
+    __slots__ = ("orders", "fills", "cancels", "matching")
+
+    orders: int
+    fills: int
+    cancels: int
+    # ns spent in Clob.insert_order per order
+    matching: Histogram
+
+    def __init__(self):
+        self.orders = 0
+        self.fills = 0
+        self.cancels = 0
+        self.matching = Histogram()
+
+    def merge(self, other: BookStats):
+        self.orders += other.orders
+        self.fills += other.fills
+        self.cancels += other.cancels
+        self.matching.merge(other.matching)
+
+
+# read off a book when metrics are scraped
+class MarketGauges(NamedTuple):
+    market_id: str
+    bid_levels: int
+    ask_levels: int
+    resting: int
+    trades: int
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _seconds(ns: int) -> str:
+    return repr(ns / 1e9)
+
+
+# prometheus text exposition format, version 0.0.4
+
+
+def header(name: str, kind: str, help: str) -> Iterator[str]:
+    yield f"# HELP {name} {help}"
+    yield f"# TYPE {name} {kind}"
+
+
+def sample(name: str, value: int | float, labels: dict[str, str] = {}) -> str:
+    return f"{name}{_labels(labels)} {value}"
+
+
+# a histogram of ns values, exposed in seconds with buckets at 2 ** b ns
+def histogram(
+    name: str, hist: Histogram, buckets: range, labels: dict[str, str] = {}
+) -> Iterator[str]:
+    cumulative = list(accumulate(hist.counts))
+    for b in buckets:
+        yield sample(f"{name}_bucket", cumulative[b], labels | {"le": _seconds(2**b)})
+
+    yield sample(f"{name}_bucket", cumulative[-1], labels | {"le": "+Inf"})
+    yield sample(f"{name}_sum", _seconds(hist.sum), labels)
+    yield sample(f"{name}_count", cumulative[-1], labels)
+
+
+def render(
+    requests: dict[tuple[str, str], Histogram],
+    stats: BookStats,
+    markets: list[MarketGauges],
+) -> str:
+    lines = []
+
+    lines += header(
+        "markets_request_duration_seconds",
+        "histogram",
+        "Time until the response starts, by method and route.",
+    )
+    for (method, route), hist in requests.items():
+        lines += histogram(
+            "markets_request_duration_seconds",
+            hist,
+            REQUEST_BUCKETS,
+            {"method": method, "route": route},
+        )
+
+    lines += header(
+        "markets_matching_duration_seconds",
+        "histogram",
+        "Time spent matching and resting each order.",
+    )
+    lines += histogram(
+        "markets_matching_duration_seconds", stats.matching, MATCHING_BUCKETS
+    )
+
+    for name, value, help in (
+        ("markets_orders_total", stats.orders, "Orders placed."),
+        ("markets_fills_total", stats.fills, "Fills between orders."),
+        ("markets_cancels_total", stats.cancels, "Resting orders cancelled."),
+    ):
+        lines += header(name, "counter", help)
+        lines.append(sample(name, value))
+
+    lines += header("markets_book_levels", "gauge", "Price levels with resting orders.")
+    for m in markets:
+        for side, levels in (("bid", m.bid_levels), ("ask", m.ask_levels)):
+            labels = {"market": m.market_id, "side": side}
+            lines.append(sample("markets_book_levels", levels, labels))
+
+    for name, field, help in (
+        ("markets_resting_orders", "resting", "Orders resting on the book."),
+        ("markets_tape_trades", "trades", "Trades on the market's tape."),
+    ):
+        lines += header(name, "gauge", help)
+        for m in markets:
+            lines.append(sample(name, getattr(m, field), {"market": m.market_id}))
+
+    return "\n".join(lines) + "\n"
@@ -5,6 +5,9 @@ from pydantic import BaseModel, Field
 
 import uuid
 
+from candles import Resolution
+from clob import MAX_PRICE, MAX_QUANTITY, MIN_PRICE
+
 type Uuid = str
 
 
@@ -17,9 +20,21 @@ class User(Model):
     pass
 
 
+type Outcome = Literal["yes", "no"]
+
+# what one contract pays out on each outcome
+OUTCOME_PRICES: dict[Outcome, int] = {"yes": MAX_PRICE, "no": MIN_PRICE}
+
+
+def to_outcome(price: int) -> Outcome:
+    return next(o for o, p in OUTCOME_PRICES.items() if p == price)
+
+
 class Market(Model):
     name: str
     description: str
+    # set once the market has resolved, it takes no more orders
+    outcome: Outcome | None = None
 
 
 class MarketCreateInfo(BaseModel):
@@ -28,16 +43,63 @@ class MarketCreateInfo(BaseModel):
     description: str
 
 
+# synthetic price history written straight onto a new market's trade tape
+class PriceSeedInfo(BaseModel):
+    points: int = Field(default=5, ge=1, le=10_000)
+    start: int = Field(default=50, ge=MIN_PRICE, le=MAX_PRICE)
+    # seconds between seeded trades, the last one is at creation time
+    interval: float = Field(default=60.0, ge=0)
+
+
+class MarketBulkCreateInfo(BaseModel):
+    markets: list[MarketCreateInfo]
+    seed: PriceSeedInfo | None = None
+
+
 type OrderSide = Literal["bid", "ask"]
 
 
 class OrderCreateInfo(BaseModel):
     user_id: Uuid
     side: OrderSide
+    price: int = Field(ge=MIN_PRICE, le=MAX_PRICE)
+    quantity: int = Field(gt=0, le=MAX_QUANTITY)
+
+
+class MarketOrderCreateInfo(OrderCreateInfo):
+    market_id: Uuid
+
+
+class ResolveInfo(BaseModel):
+    outcome: Outcome
+
+
+class MarketResolveInfo(ResolveInfo):
+    market_id: Uuid
+
+
+class MarketResolution(BaseModel):
+    market_id: Uuid
+    outcome: Outcome
+    # resting orders dropped from the book
+    cancelled: int
+    # open positions paid out
+    positions: int
+
+
+class OrderFill(BaseModel):
     price: int
     quantity: int
 
 
+class OrderResult(BaseModel):
+    market_id: Uuid
+    # set if part of the order is left resting on the book
+    resting_id: Uuid | None
+    remaining: int
+    fills: list[OrderFill]
+
+
 class MarketList(BaseModel):
     markets: list[Market]
 
@@ -54,11 +116,65 @@ class MarketTrades(BaseModel):
     market_id: Uuid
     midpoint: float | None
     trades: list[MarketTrade]
+    # pass as `after` for the next newer page, or `before` for the older one
+    after: int
+    before: int
+
+
+class MarketCandle(BaseModel):
+    # bucket start
+    time: datetime
+    open: int
+    high: int
+    low: int
+    close: int
+    volume: int
+    vwap: float
+
+
+class MarketCandles(BaseModel):
+    market_id: Uuid
+    resolution: Resolution
+    candles: list[MarketCandle]
 
 
 class UserTrades(BaseModel):
     user_id: Uuid
     trades: list[MarketTrade]
+    # pass as `after` for the next newer page, or `before` for the older one
+    after: str
+    before: str
+
+
+class UserPosition(BaseModel):
+    market_id: Uuid
+    # positive when long, negative when short
+    quantity: int
+    # average price the open quantity was entered at, None while flat
+    entry_price: float | None
+    realized_pnl: float
+
+
+class UserPortfolio(BaseModel):
+    user_id: Uuid
+    # received for asks filled less paid for bids filled
+    cash: int
+    realized_pnl: float
+    positions: list[UserPosition]
+
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: Uuid
+    # realized plus unrealized
+    pnl: float
+    realized_pnl: float
+    # open positions marked at each market's midpoint, or its last trade
+    unrealized_pnl: float
+
+
+class Leaderboard(BaseModel):
+    entries: list[LeaderboardEntry]
 
 
 class MarketClobOrder(BaseModel):
@@ -73,6 +189,29 @@ class MarketClob(BaseModel):
     asks: list[MarketClobOrder]
 
 
+class MarketTop(BaseModel):
+    midpoint: float | None
+
+    bid: MarketClobOrder | None
+    ask: MarketClobOrder | None
+
+
+class MarketStreamSnapshot(MarketClob):
+    type: Literal["snapshot"] = "snapshot"
+    seq: int
+
+
+# levels whose total changed, quantity 0 once a level empties
+class MarketStreamDelta(BaseModel):
+    type: Literal["delta"] = "delta"
+    seq: int
+    midpoint: float | None
+
+    bids: list[MarketClobOrder]
+    asks: list[MarketClobOrder]
+    trades: list[MarketTrade]
+
+
 class Order(Model):
     user_id: Uuid
     side: OrderSide
@@ -0,0 +1,62 @@
+from collections.abc import Iterable
+from datetime import datetime
+
+import orjson
+
+from exchange import TradeSlice
+from models import Market, Uuid
+
+# bodies of the hot read endpoints, encoded with orjson straight from what the
+# engine returns instead of building a pydantic model per row. The fields and
+# their order follow the models in models.py, so the bytes are the same as
+# the models would serialize to
+
+
+def market_trades(market_id: Uuid, tape: TradeSlice) -> bytes:
+    return orjson.dumps(
+        {
+            "market_id": market_id,
+            "midpoint": tape.midpoint,
+            "trades": [
+                {
+                    "market_id": market_id,
+                    "side": None,
+                    "time": datetime.fromtimestamp(t / 1e9),
+                    "price": p,
+                    "quantity": q,
+                }
+                for t, p, q in zip(tape.time, tape.price, tape.quantity)
+            ],
+            "after": tape.stop,
+            "before": tape.start,
+        }
+    )
+
+
+def clob(
+    midpoint: float | None, bids: list[tuple[int, int]], asks: list[tuple[int, int]]
+) -> bytes:
+    return orjson.dumps(
+        {
+            "midpoint": midpoint,
+            "bids": [{"price": p, "quantity": q} for p, q in bids],
+            "asks": [{"price": p, "quantity": q} for p, q in asks],
+        }
+    )
+
+
+def market_list(markets: Iterable[Market]) -> bytes:
+    return orjson.dumps(
+        {
+            "markets": [
+                {
+                    "id": m.id,
+                    "created_at": m.created_at,
+                    "name": m.name,
+                    "description": m.description,
+                    "outcome": m.outcome,
+                }
+                for m in markets
+            ]
+        }
+    )
@@ -0,0 +1,22 @@
+import numpy as np
+
+from clob import MAX_PRICE, MIN_PRICE
+
+
+# one multiplicative random walk per row: each step scales the last price by a
+# factor in [0.5, 1.5) and clamps it to the ladder, matching the walk that
+# backend/gen_markets.py used to drive over HTTP
+def price_walks(
+    n: int, points: int, start: int = 50, rng: np.random.Generator | None = None
+) -> np.ndarray:
+    rng = rng or np.random.default_rng()
+    factors = rng.random((n, points)) + 0.5
+
+    walks = np.empty((n, points), dtype=np.int8)
+    prices = np.full(n, start, dtype=np.int64)
+    for k in range(points):
+        prices = (prices * factors[:, k]).astype(np.int64)
+        prices = np.clip(prices, MIN_PRICE, MAX_PRICE)
+        walks[:, k] = prices
+
+    return walks
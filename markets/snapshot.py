@@ -0,0 +1,327 @@
+from __future__ import annotations
+
+import os
+import struct
+import traceback
+from array import array
+from datetime import datetime
+
+from clob import Clob, LimitOrder
+from db import Db
+from exchange import Exchange
+from models import OUTCOME_PRICES, Market, to_outcome
+
+# header: magic, format version, journal size the snapshot is consistent with
+MAGIC = b"MKSN"
+VERSION = 5
+HEADER = struct.Struct("<4sIQ")
+
+U32 = struct.Struct("<I")
+I64 = struct.Struct("<q")
+
+SIDES = ["bid", "ask"]
+
+
+class Writer:
+    parts: list[bytes]
+
+    def __init__(self):
+        self.parts = []
+
+    def u32(self, v: int):
+        self.parts.append(U32.pack(v))
+
+    def i64(self, v: int):
+        self.parts.append(I64.pack(v))
+
+    def string(self, s: str):
+        b = s.encode()
+        self.parts.append(U32.pack(len(b)))
+        self.parts.append(b)
+
+    def array(self, a: array):
+        self.parts.append(U32.pack(len(a)))
+        self.parts.append(a.tobytes())
+
+
+class Reader:
+    data: memoryview
+    pos: int
+
+    def __init__(self, data: bytes, pos: int = 0):
+        self.data = memoryview(data)
+        self.pos = pos
+
+    def u32(self) -> int:
+        (v,) = U32.unpack_from(self.data, self.pos)
+        self.pos += U32.size
+        return v
+
+    def i64(self) -> int:
+        (v,) = I64.unpack_from(self.data, self.pos)
+        self.pos += I64.size
+        return v
+
+    def string(self) -> str:
+        n = self.u32()
+        s = str(self.data[self.pos : self.pos + n], "utf-8")
+        self.pos += n
+        return s
+
+    def array(self, typecode: str) -> array:
+        a = array(typecode)
+        n = self.u32() * a.itemsize
+        a.frombytes(self.data[self.pos : self.pos + n])
+        self.pos += n
+        return a
+
+
+def _dump_clob(w: Writer, clob: Clob):
+    w.i64(clob.next_order_id)
+    w.array(array("i", clob.users))
+
+    # resting orders, each side best level first and each level in FIFO order,
+    # so re-appending them in this order rebuilds the queues
+    ids, users, sides, prices, quantities, times = (
+        array("q"),
+        array("i"),
+        array("b"),
+        array("b"),
+        array("q"),
+        array("q"),
+    )
+    for ladder in (clob.bids, clob.asks):
+        for level in ladder:
+            for o in level:
+                ids.append(o.id)
+                users.append(o.user)
+                sides.append(SIDES.index(o.side))
+                prices.append(o.price)
+                quantities.append(o.quantity)
+                times.append(o.time)
+
+    for a in (ids, users, sides, prices, quantities, times):
+        w.array(a)
+
+    tape = clob.trades
+    for a in (tape.time, tape.price, tape.quantity, tape.buyer, tape.seller):
+        w.array(a)
+
+    # candles are stored rather than rebuilt, so loading does not walk the tape
+    for s in tape.candles.series:
+        for a in (s.start, s.open, s.high, s.low, s.close, s.volume, s.notional):
+            w.array(a)
+
+
+def _load_clob(r: Reader, clob: Clob):
+    clob.next_order_id = r.i64()
+    clob.users = set(r.array("i"))
+
+    ids, users, sides, prices, quantities, times = (
+        r.array(t) for t in ("q", "i", "b", "b", "q", "q")
+    )
+    for i in range(len(ids)):
+        order = LimitOrder(
+            ids[i], users[i], SIDES[sides[i]], prices[i], quantities[i], times[i]
+        )
+        ladder = clob.bids if order.side == "bid" else clob.asks
+        ladder.get_order_price(order).append(order)
+        clob.orders[order.id] = order
+
+    tape = clob.trades
+    tape.time = r.array("q")
+    tape.price = r.array("b")
+    tape.quantity = r.array("q")
+    tape.buyer = r.array("i")
+    tape.seller = r.array("i")
+
+    for series in tape.candles.series:
+        series.start = r.array("q")
+        series.open = r.array("b")
+        series.high = r.array("b")
+        series.low = r.array("b")
+        series.close = r.array("b")
+        series.volume = r.array("q")
+        series.notional = r.array("q")
+
+
+def shard_path(path: str, shard: int) -> str:
+    return f"{path}.{shard}"
+
+
+def dump(
+    path: str,
+    markets: Db[Market],
+    exchange: Exchange,
+    journal_size: int,
+    shards: int = 0,
+):
+    w = Writer()
+    w.parts.append(HEADER.pack(MAGIC, VERSION, journal_size))
+    # how many shard snapshots at the same journal size hold the books; with
+    # MARKETS_SHARDS this file only has the markets and `exchange` is empty
+    w.u32(shards)
+
+    w.u32(len(markets.store))
+    for market in markets.store.values():
+        w.string(market.id)
+        w.string(market.name)
+        w.string(market.description)
+        w.i64(int(market.created_at.timestamp() * 1e9))
+        w.i64(-1 if market.outcome is None else OUTCOME_PRICES[market.outcome])
+
+    w.u32(len(exchange.user_ids.ids))
+    for id in exchange.user_ids.ids:
+        w.string(id)
+
+    w.u32(len(exchange.books))
+    for clob, seq in zip(exchange.books, exchange.market_seq):
+        w.string(clob.id)
+        w.i64(seq)
+        # settlement price, -1 while open
+        w.i64(-1 if clob.settled is None else clob.settled)
+        _dump_clob(w, clob)
+
+    for fills, joined in zip(exchange.user_fills, exchange.user_markets):
+        w.array(fills.markets)
+        w.array(fills.rows)
+        w.array(array("i", joined))
+
+    # likewise the ledger, rather than replaying every fill into it
+    ledger = exchange.ledger
+    for a in (
+        ledger.cash,
+        ledger.user,
+        ledger.market,
+        ledger.quantity,
+        ledger.cost,
+        ledger.realized,
+    ):
+        w.array(a)
+
+    # write beside the old snapshot and swap it in, so a crash mid-dump
+    # leaves the previous snapshot intact
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.writelines(w.parts)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp, path)
+
+
+def _read(path: str) -> tuple[Reader, int, int]:
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version, journal_size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a markets snapshot")
+    if version != VERSION:
+        raise ValueError(f"unsupported snapshot version {version}")
+
+    r = Reader(data, HEADER.size)
+
+    return r, journal_size, r.u32()
+
+
+# (journal size, shard snapshots) of the snapshot at path
+def header(path: str) -> tuple[int, int]:
+    _, journal_size, shards = _read(path)
+
+    return journal_size, shards
+
+
+# restores into empty stores, returning the journal size to replay from
+def load(path: str, markets: Db[Market], exchange: Exchange) -> int:
+    r, journal_size, _ = _read(path)
+
+    for _ in range(r.u32()):
+        market = Market(
+            id=r.string(),
+            name=r.string(),
+            description=r.string(),
+            created_at=datetime.fromtimestamp(r.i64() / 1e9),
+        )
+        if (settled := r.i64()) >= 0:
+            market.outcome = to_outcome(settled)
+        markets.insert(market)
+
+    for _ in range(r.u32()):
+        exchange.user(r.string())
+
+    for _ in range(r.u32()):
+        clob = exchange.add_clob(r.string(), r.i64())
+        if (settled := r.i64()) >= 0:
+            clob.settled = settled
+        _load_clob(r, clob)
+
+    for fills, joined in zip(exchange.user_fills, exchange.user_markets):
+        fills.markets = r.array("i")
+        fills.rows = r.array("q")
+        joined.extend(r.array("i"))
+
+    ledger = exchange.ledger
+    ledger.cash = r.array("q")
+    ledger.user = r.array("i")
+    ledger.market = r.array("i")
+    ledger.quantity = r.array("q")
+    ledger.cost = r.array("d")
+    ledger.realized = r.array("d")
+    ledger.reindex()
+
+    return journal_size
+
+
+# dumps from a forked child, so the copy-on-write image of the parent is
+# serialised while the parent keeps matching
+class Snapshotter:
+    path: str
+    child: int | None
+
+    def __init__(self, path: str):
+        self.path = path
+        self.child = None
+
+    def running(self) -> bool:
+        if self.child is None:
+            return False
+
+        pid, _ = os.waitpid(self.child, os.WNOHANG)
+        if pid == 0:
+            return True
+
+        self.child = None
+        return False
+
+    def start(
+        self,
+        markets: Db[Market],
+        exchange: Exchange,
+        journal_size: int,
+        shards: int = 0,
+    ):
+        if self.running():
+            return
+
+        if not hasattr(os, "fork"):
+            dump(self.path, markets, exchange, journal_size, shards)
+            return
+
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                dump(self.path, markets, exchange, journal_size, shards)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+
+        self.child = pid
+
+    def wait(self):
+        if self.child is not None:
+            os.waitpid(self.child, 0)
+            self.child = None
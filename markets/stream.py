@@ -0,0 +1,59 @@
+import asyncio
+
+from exchange import Update
+
+
+# one stream's backlog of updates; publishing never waits on a subscriber, a full
+# queue marks it lagged and the stream resyncs from a fresh snapshot
+class Subscription:
+    market_id: str
+    queue: asyncio.Queue[Update]
+    lagged: bool
+
+    def __init__(self, market_id: str, maxsize: int):
+        self.market_id = market_id
+        self.queue = asyncio.Queue(maxsize)
+        self.lagged = False
+
+    def reset(self):
+        self.queue = asyncio.Queue(self.queue.maxsize)
+        self.lagged = False
+
+
+class Hub:
+    subscriptions: dict[str, set[Subscription]]
+    maxsize: int
+
+    def __init__(self, maxsize: int = 1024):
+        self.subscriptions = {}
+        self.maxsize = maxsize
+
+    # returns whether this is the market's first subscription
+    def subscribe(self, market_id: str) -> tuple[Subscription, bool]:
+        sub = Subscription(market_id, self.maxsize)
+        subs = self.subscriptions.setdefault(market_id, set())
+        subs.add(sub)
+
+        return sub, len(subs) == 1
+
+    # returns whether this was the market's last subscription
+    def unsubscribe(self, sub: Subscription) -> bool:
+        subs = self.subscriptions[sub.market_id]
+        subs.discard(sub)
+
+        if subs:
+            return False
+
+        del self.subscriptions[sub.market_id]
+        return True
+
+    def publish(self, updates: list[Update]):
+        for update in updates:
+            for sub in self.subscriptions.get(update.market_id, ()):
+                if sub.lagged:
+                    continue
+
+                try:
+                    sub.queue.put_nowait(update)
+                except asyncio.QueueFull:
+                    sub.lagged = True
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left
+
+from candles import Candles
+
+
+# buyer/seller of trades not matched between users, e.g. seeded history
+NO_USER = -1
+
+
+# append-only, column-per-field trade history of one market; rows are in time
+# order so the time column can be bisected
+class TradeTape:
+    time: array[int]
+    price: array[int]
+    quantity: array[int]
+    buyer: array[int]
+    seller: array[int]
+
+    candles: Candles
+
+    def __init__(self):
+        self.time = array("q")
+        self.price = array("b")
+        self.quantity = array("q")
+        self.buyer = array("i")
+        self.seller = array("i")
+        self.candles = Candles()
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def append(
+        self, buyer: int, seller: int, time: int, price: int, quantity: int
+    ) -> int:
+        # keep the time column sorted even if the wall clock steps back
+        if self.time and time < self.time[-1]:
+            time = self.time[-1]
+
+        self.time.append(time)
+        self.price.append(price)
+        self.quantity.append(quantity)
+        self.buyer.append(buyer)
+        self.seller.append(seller)
+        self.candles.add(time, price, quantity)
+
+        return len(self.time) - 1
+
+    # bulk append of trades with no counterparties; times must be ascending
+    def extend(self, time: array[int], price: array[int], quantity: array[int]):
+        if self.time and time and time[0] < self.time[-1]:
+            raise ValueError("trades must not predate the tape")
+
+        self.time.extend(time)
+        self.price.extend(price)
+        self.quantity.extend(quantity)
+        self.buyer.extend(array("i", [NO_USER]) * len(time))
+        self.seller.extend(array("i", [NO_USER]) * len(time))
+
+        for t, p, q in zip(time, price, quantity):
+            self.candles.add(t, p, q)
+
+    # indices of the trades with start <= time < end
+    def between(self, start: int | None = None, end: int | None = None) -> range:
+        lo = 0 if start is None else bisect_left(self.time, start)
+        hi = len(self.time) if end is None else bisect_left(self.time, end, lo)
+
+        return range(lo, hi)
@@ -0,0 +1,144 @@
+import os
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as service
+import snapshot
+from db import Db
+from engine import Engine
+from exchange import Exchange
+
+USERS = ["alice", "bob", "carol"]
+
+
+# everything recovery has to bring back: markets, each book's queues in FIFO
+# order, tape, candles and user set, and every user's fill index and portfolio;
+# book seqs restart with the process, so they are left out
+def state() -> list:
+    exchange = service.EXCHANGE
+
+    out: list = [list(exchange.user_ids.ids)]
+    out += [(m.id, m.name, m.outcome) for m in service.MARKETS.store.values()]
+    for clob in exchange.books:
+        tape = clob.trades
+        out.append((clob.id, clob.next_order_id, sorted(clob.users)))
+        out.append(
+            [
+                (o.id, o.user, o.side, o.price, o.quantity, o.time)
+                for ladder in (clob.bids, clob.asks)
+                for level in ladder
+                for o in level
+            ]
+        )
+        out.append([tape.time, tape.price, tape.quantity, tape.buyer, tape.seller])
+        out.append([exchange.candles(clob.id, r) for r in ("1m", "1h", "1d")])
+
+    for user in USERS:
+        out.append(exchange.user_trades(user))
+        out.append(exchange.portfolio(user))
+
+    return out
+
+
+def new_markets(client: TestClient, n: int) -> list[str]:
+    return [
+        client.post("/markets/", json={"name": f"m{i}", "description": ""}).json()["id"]
+        for i in range(n)
+    ]
+
+
+def traffic(client: TestClient, market_ids: list[str], n: int, seed: int):
+    rng = random.Random(seed)
+    orders = []
+    for _ in range(n):
+        market_id = rng.choice(market_ids)
+        r = client.post(
+            f"/markets/{market_id}/order",
+            json={
+                "user_id": rng.choice(USERS),
+                "side": rng.choice(["bid", "ask"]),
+                "price": rng.randint(30, 70),
+                "quantity": rng.randint(1, 9),
+            },
+        )
+        orders.append((market_id, r.json()["id"]))
+
+        if rng.random() < 0.3:
+            market_id, order_id = rng.choice(orders)
+            client.delete(f"/markets/{market_id}/order/{order_id}")
+
+
+# a fresh process: empty markets and exchange, recovering from `journal_path`
+# and `snapshot_path` on startup
+@pytest.fixture
+def restart(monkeypatch):
+    monkeypatch.setattr(service, "shards", 0)
+    monkeypatch.setattr(service, "snapshot_interval", 3600)
+
+    def restart(journal_path: str | None, snapshot_path: str | None):
+        exchange = Exchange()
+        engine = Engine.local(exchange)
+        engine.listen(service.HUB.publish)
+
+        monkeypatch.setattr(service, "MARKETS", Db())
+        monkeypatch.setattr(service, "EXCHANGE", exchange)
+        monkeypatch.setattr(service, "ENGINE", engine)
+        monkeypatch.setattr(service, "journal_path", journal_path)
+        monkeypatch.setattr(service, "snapshot_path", snapshot_path)
+
+        return TestClient(service.app)
+
+    return restart
+
+
+def test_snapshot_round_trip(restart, tmp_path):
+    journal_path = str(tmp_path / "journal")
+    snapshot_path = str(tmp_path / "snapshot")
+
+    # the shutdown snapshot covers the whole journal
+    with restart(journal_path, snapshot_path) as client:
+        market_ids = new_markets(client, 3)
+        traffic(client, market_ids, 400, seed=1)
+        client.post(f"/markets/{market_ids[0]}/resolve", json={"outcome": "yes"})
+        traffic(client, market_ids[1:], 100, seed=2)
+        before = state()
+
+    # without the journal everything has to come from the snapshot
+    with restart(None, snapshot_path):
+        assert state() == before
+
+
+@pytest.mark.parametrize("snapshotted", [False, True])
+def test_journal_torn_tail(restart, tmp_path, snapshotted):
+    journal_path = str(tmp_path / "journal")
+    snapshot_path = str(tmp_path / "snapshot")
+
+    with restart(journal_path, None) as client:
+        market_ids = new_markets(client, 3)
+        traffic(client, market_ids, 300, seed=3)
+
+        # a snapshot part way through, so recovery replays only the tail after it
+        if snapshotted:
+            service.JOURNAL.flush()
+            snapshot.dump(
+                snapshot_path,
+                service.MARKETS,
+                service.EXCHANGE,
+                service.JOURNAL.size,
+            )
+
+        traffic(client, market_ids, 300, seed=4)
+        before = state()
+
+    # a crash part way through writing a record
+    size = os.path.getsize(journal_path)
+    with open(journal_path, "ab") as f:
+        f.write(b"\x10\x00\x00\x00\x01")
+
+    with restart(journal_path, snapshot_path if snapshotted else None):
+        assert state() == before
+
+    # the torn record is cut off so new records follow the last good one
+    assert os.path.getsize(journal_path) == size